@@ -1,15 +1,32 @@
 #!/bin/sh
 
 
-# mount USB drive
+# wait until a condition is met, for at most $1 tenths of a second
 
-sleep 2
-if [ -e "/dev/sda" ]; then
+wait_for() {
+  timeout=$1
+  shift
+
+  while ! "$@"; do
+    if [ "$timeout" -le 0 ]; then
+      return 1
+    fi
+
+    sleep 0.1
+    timeout=$((timeout - 1))
+  done
+}
+
+
+# mount USB drive as soon as it shows up
+
+if wait_for 50 [ -e "/dev/sda1" ]; then
   mount /dev/sda1 /mnt/usb
+  wait_for 50 mountpoint -q /mnt/usb || echo "USB drive could not be mounted"
+else
+  echo "no USB drive found"
 fi
 
-sleep 7
-
 
 # run prompter directly from USB drive if available (allows newer versions)
 
@@ -22,4 +39,4 @@ fi
 
 
 echo "\n\n----------------------------\n\n"
-LD_LIBRARY_PATH=/usr/local/lib python3 src/prompter.py
+LD_LIBRARY_PATH=/usr/local/lib python3 src
@@ -1,19 +1,49 @@
+import time
+startTime = time.monotonic()    # startup timing includes the imports
+
 import pygame
 import os
-import time
 import math
 import threading
+from functools import partial
 
 import wurolib
 from wurolib import print
 
-from midi import MidiThread
+from midi import MidiThread, waitForDevices
+from midicapture import MidiRecorder
+from scheduler import Scheduler
+from pages import PageFile, PageIndex, LINE_BLINK, LINE_MOUSEPOS, STEP_SEND, STEP_CALL
+import pagecache
+from library import PageLibrary
+from recordings import RecordingIndex, SORT_DATE, SORT_NAME
+from render import LRUCache, DirtyScreen, renderPageSurface
+from app import PrompterApp
+from fontcache import TextCache
 from audio import AudioThread
+from ioloop import IOLoop, Worker
+from watcher import FileWatcher
+from timing import StartupTimer, getUptime
+import metrics
 
 
 DEBUG = not True
 ROTATED_DISPLAY = True
 
+METER_RATE = 20         # redraws per second while the meters are live
+AUDIO_PROCESS = False   # capture and meter audio in a separate process
+PRE_ROLL = 0            # seconds of audio captured before REC is pressed, 0 to capture on demand
+PREALLOCATE = 0         # seconds of disk space reserved for each recording, 0 for none
+PLAY_DEVICE = 'default' # alsa device for playback, or 'null' / 'file:PATH' for testing
+SEEK_STEP = 5           # seconds skipped by the left and right keys while playing
+
+MIDI_LATENCY = 0.002    # max. seconds between arrival and handling of midi input
+PAGE_COALESCE = 0.01    # page changes closer than this are coalesced into one
+MIDI_WAIT = 20          # seconds the midi interface is waited for at startup
+
+METRICS_EXPORT = None   # 'file:PATH' or 'udp:HOST:PORT' to export the metrics periodically
+METRICS_INTERVAL = 10   # seconds between metrics exports
+
 MIN_X = 3936
 MAX_X = 227
 MIN_Y = 268
@@ -24,7 +54,11 @@ MAX_Y = 3880
 SCR_W = 160
 SCR_H = 106
 
+FONT_FILE = 'gfx/moonfont.png'
 FONT_W, FONT_H = 6, 8
+FONT_ZOOM = 1
+
+TEXT_CACHE_SIZE = 256   # number of rendered lines of text kept in memory
 
 LAST_LINE = SCR_H // FONT_H -1
 
@@ -74,6 +108,13 @@ def getMousePos(e):
 
     return xpos, ypos
 
+def rowRect(y, rows=1):
+    return pygame.Rect(0, math.floor(y * FONT_H * FONT_ZOOM), SCR_W, rows * FONT_H * FONT_ZOOM)
+
+def textRect(x, y, chars):
+    return pygame.Rect(math.floor(x * FONT_W * FONT_ZOOM), math.floor(y * FONT_H * FONT_ZOOM),
+                       chars * FONT_W * FONT_ZOOM, FONT_H * FONT_ZOOM)
+
 def getMousePosRaw(e):
     xpos = e.pos[1]
     ypos = e.pos[0]
@@ -82,45 +123,142 @@ def getMousePosRaw(e):
 
 pages = {}
 pageCmds = {}
+pageIndex = PageIndex([])
+
+pageFile = PageFile(COLORS)
+
+PAGE_CACHE_SIZE = 16    # number of pre-rendered page surfaces kept in memory
+LIBRARY_SIZE = 32       # number of pages of a page library kept in memory
+
+pageSurfaces = LRUCache(PAGE_CACHE_SIZE)
+pageLibrary = None
+
+def getPagesPath():
+    return os.path.join(getPath(), 'pages.txt')
+
+def getLibraryPath():
+    # a directory with one file per page, used instead of pages.txt if present
+    return os.path.join(getPath(), 'pages')
+
+def readPages():
+    with open(getPagesPath(), 'r') as f:
+        return pageFile.update(f)
+
+def reportErrors(errors, source='pages.txt'):
+    for error in errors:
+        print('%s:' % source, error)
+
+    if errors:
+        showError('%i error(s) in %s' % (len(errors), source))
 
 def loadData():
-    global pages
-    
-    path = getPath()
-    
-    with open(os.path.join(path, 'pages.txt'), 'r') as f:
-        rawdata = f.readlines()
-        page_id = None
-        
-        for i, line in enumerate(rawdata):
-            if line.startswith('PAGE:'):
-                page_id = line.split(':')[1].strip()
-                print('found page:', page_id)
-                
-                pages[page_id] = []
-                
-            elif line.startswith('---'):
-                continue
-            elif line.startswith('CMD:'):
-                cmd_key, cmd_exec = line[4:].strip().split(' ', 1)
-                if not page_id in pageCmds:
-                    pageCmds[page_id] = {}
-                pageCmds[page_id][cmd_key] = cmd_exec
-            else:
-                if page_id is not None:
-                    pages[page_id].append(line)
+    global pages, pageCmds, pageIndex, pageLibrary
+
+    if os.path.isdir(getLibraryPath()):
+        # only the page names are read here, the pages are loaded on demand
+        pageLibrary = PageLibrary(getLibraryPath(), COLORS, maxResident=LIBRARY_SIZE, onLoad=pageLoaded)
+        changed, removed, errors = pageLibrary.refresh()
+        reportErrors(errors, 'library')
+
+        pages = pageLibrary.pages
+        pageCmds = pageLibrary.pageCmds
+        pageIndex = pageLibrary.index
+
+        print('library: %i pages' % len(pageIndex))
+    else:
+        errors = pagecache.load(pageFile, getPagesPath())
+        reportErrors(errors)
+
+        pages = pageFile.pages
+        pageCmds = pageFile.pageCmds
+        pageIndex = PageIndex(pages.keys())
+
+        bindCommands(pageCmds)
+
+    if pages and not mainScreen.currentPage in pages:
+        mainScreen.currentPage = next(iter(pages))
+
+def pageLoaded(name, cmds, errors):
+    # called by the page library, in the main or the worker thread
+    bindCommands({name: cmds})
+    reportErrors(errors, 'library')
+
+def prefetchPage(pagename):
+    if pageLibrary and worker:
+        worker.submit(pageLibrary.prefetch, pagename)
+
+def reloadData():
+    # called by the file watcher in the worker thread, the new pages are
+    # swapped in by the main loop
+    try:
+        changed, removed, errors = readPages()
+    except OSError as e:
+        print('could not reload pages:', e)
+        return
+
+    print('pages.txt changed: %i page(s) updated, %i removed' % (len(changed), len(removed)))
+    pagecache.save(pageFile, getPagesPath())
+
+    mainApp.callSoon(applyReload, pageFile.pages, pageFile.pageCmds, PageIndex(pageFile.pages.keys()),
+                     changed, removed, errors)
+
+def reloadLibrary():
+    # called by the file watcher in the worker thread
+    try:
+        changed, removed, errors = pageLibrary.refresh()
+    except OSError as e:
+        print('could not reload library:', e)
+        return
+
+    print('library changed: %i page(s) updated, %i removed' % (len(changed), len(removed)))
+
+    mainApp.callSoon(applyReload, pageLibrary.pages, pageLibrary.pageCmds, pageLibrary.index,
+                     changed, removed, errors)
+
+def applyReload(newPages, newCmds, newIndex, changed, removed, errors):
+    global pages, pageCmds, pageIndex
+
+    if not newPages:
+        showError('no pages found')
+        return
+
+    bindCommands({name: cmds for name, cmds in newCmds.items() if name in changed})
+
+    pages = newPages
+    pageCmds = newCmds
+    pageIndex = newIndex
+
+    outdated = set(changed + removed)
+    pageSurfaces.invalidate(lambda key: key[0] in outdated)
+
+    reportErrors(errors)
+
+    if not mainScreen.currentPage in pages:
+        showError('page %s was removed' % mainScreen.currentPage)
+        mainScreen.currentPage = 'DEFAULT' if 'DEFAULT' in pages else next(iter(pages))
+
+def bindCommands(cmdsPerPage):
+    if midiThread is None:
+        return  # bound once midi is initialized
+
+    for cmds in cmdsPerPage.values():
+        for program in cmds.values():
+            program.bind(midiThread, toggleConsole)
 
 
 # --
 
 
-class MainScreen(wurolib.Screen):
-    def __init__(self, context):
-        super().__init__(context)
+class MainScreen(DirtyScreen):
+    def __init__(self, context, textCache):
+        super().__init__(context, textCache)
         self.currentPage = 'DEFAULT'
+        self.renderedPage = None
         
         self.cmdQueue = []
         self.cmdQueuePage = None
+        self.cmdTimer = None    # quantized commands waiting in the scheduler
+        self.cmdQueueDepth = metrics.registry.histogram('commands.queue', metrics.SIZE_BUCKETS)
 
         self.lastMousePos = (0, 0)
         self.lastMousePosRaw = (0, 0)
@@ -128,64 +266,119 @@ class MainScreen(wurolib.Screen):
 
         self.debounceRecording = False
 
+        self.jumpQuery = None   # text typed in jump-to-page mode
+        self.jumpMatch = 0
+
     def render(self):
-        self.context.fill(COLORS[6])
+        page = pages[self.currentPage]
 
-        self.drawPage()
-        self.drawRecLabel()
-        self.drawMeters()
+        if page is not self.renderedPage:
+            self.renderedPage = page
+            self.invalidate()
 
-        if error_message:
-            self.context.center(error_message, y=LAST_LINE-1, fgcolor=COLORS[1], bgcolor=COLORS[2])
+        background = pageSurfaces.get((page.name, SCR_W, SCR_H, FONT_ZOOM),
+                                      lambda: renderPageSurface(self.textCache, self.context.output, page, COLORS[6]))
 
-    def drawPage(self):
-        self.context.locate(0, 0.5)
-        for line in pages[self.currentPage]:
-            bgcolor = None
-            fgcolor = COLORS[1]
+        blink = (time.time() * 1000) % 1000 > 500
+        recording = audioThread.isRecording()
+        meter = audioThread.getMeter()
 
-            if line.startswith('BLINK:'):
-                if (time.time() * 1000) % 1000 > 500:
-                    line = line[6:].strip()
-                else:
-                    line = ''
+        layers = []
 
-            elif line.startswith('BGCOLOR:'):
-                color, line = line[8:].strip().split(' ', 1)
-                bgcolor = COLORS[int(color)]
-                
-            elif line.startswith('FGCOLOR:'):
-                color, line = line[8:].strip().split(' ', 1)
-                fgcolor = COLORS[int(color)]
-                
-            elif line.startswith(':MOUSEPOS'):
-                self.context.center('%i / %i' % self.lastMousePos, fgcolor=COLORS[1])
-                self.context.center('%i / %i' % self.lastMousePosRaw, fgcolor=COLORS[1])
-                self.context.center('%i / %i' % self.lastClickPos, fgcolor=COLORS[10])
-                line = ''
+        for i, line in enumerate(page.lines):
+            if line.kind == LINE_BLINK:
+                layers.append((('line', i), blink, rowRect(0.5 + line.row),
+                               partial(self.drawBlinkLine, line, blink)))
+
+            elif line.kind == LINE_MOUSEPOS:
+                state = (self.lastMousePos, self.lastMousePosRaw, self.lastClickPos)
+                layers.append((('line', i), state, rowRect(0.5 + line.row, 3),
+                               partial(self.drawMousePos, line)))
 
-            self.context.center(line, fgcolor=fgcolor, bgcolor=bgcolor)
+        layers.append(('rec', (recording, recording and blink), textRect(0.5, LAST_LINE, 6),
+                       partial(self.drawRecLabel, recording, blink)))
+        layers.append(('meters', meter, self.meterRect(),
+                       partial(self.drawMeters, meter)))
+        layers.append(('error', error_message, rowRect(LAST_LINE-1),
+                       self.drawError))
 
+        if self.jumpQuery is not None:
+            jump = self.getJumpText()
+        else:
+            jump = None
+
+        layers.append(('jump', jump, rowRect(LAST_LINE-1),
+                       partial(self.drawJump, jump)))
+
+        self.renderLayers(background, layers)
+
+    def nextRedraw(self, last):
+        if audioThread.isMetering() or self.layerStates.get('meters') != audioThread.getMeter():
+            # meters are live, or their last levels are not shown yet
+            return last + 1 / METER_RATE
+
+        if pages[self.currentPage].blinking:
+            # next flip of the blink phase
+            return (math.floor(last * 2) +1) / 2
+
+        return None
+
+    def drawBlinkLine(self, line, visible):
+        if visible:
+            self.centerText(line.text, 0.5 + line.row, line.fgcolor, line.bgcolor)
+
+    def drawMousePos(self, line):
+        y = 0.5 + line.row
+
+        self.centerText('%i / %i' % self.lastMousePos, y, COLORS[1])
+        self.centerText('%i / %i' % self.lastMousePosRaw, y +1, COLORS[1])
+        self.centerText('%i / %i' % self.lastClickPos, y +2, COLORS[10])
+
+    def drawError(self):
+        if error_message:
+            self.centerText(error_message, LAST_LINE-1, COLORS[1], COLORS[2])
+
+    def getJumpText(self):
+        matches = self.getJumpMatches()
+
+        if matches:
+            match = matches[self.jumpMatch % len(matches)]
+            return '>%s: %s (%i)' % (self.jumpQuery, match, len(matches))
 
-    def drawRecLabel(self):
-        if audioThread.isRecording():
+        return '>%s: -' % self.jumpQuery
+
+    def drawJump(self, text):
+        if text is not None:
+            self.centerText(text, LAST_LINE-1, COLORS[1], COLORS[11])
+
+    def drawRecLabel(self, recording, blink):
+        if recording:
             # show rec label
-            if (time.time() * 1000) % 1000 > 500:
-                self.context.print(' `REC ', x=0.5, y=LAST_LINE, fgcolor=COLORS[1], bgcolor=COLORS[2])
+            if blink:
+                self.drawText(' `REC ', 0.5, LAST_LINE, COLORS[1], COLORS[2])
             else:
-                self.context.print(' `REC ', x=0.5, y=LAST_LINE, fgcolor=COLORS[10], bgcolor=COLORS[2])
+                self.drawText(' `REC ', 0.5, LAST_LINE, COLORS[10], COLORS[2])
         else:
-            self.context.print('  REC ', x=0.5, y=LAST_LINE, fgcolor=COLORS[15], bgcolor=COLORS[14])
-            
-    def drawMeters(self):
+            self.drawText('  REC ', 0.5, LAST_LINE, COLORS[15], COLORS[14])
+
+    def meterGeometry(self):
         scale = (SCR_W - 9*FONT_W) / 100
         
         MX = math.floor(SCR_W - 100 * scale -5)
         MY = LAST_LINE * FONT_H
 
-        meter_left, meter_right, peak_left, peak_right = audioThread.getMeter()
+        return MX, MY, scale
+
+    def meterRect(self):
+        MX, MY, scale = self.meterGeometry()
+        return pygame.Rect(MX -1, MY -1, math.floor(100 * scale) +2, 9)
+            
+    def drawMeters(self, meter):
+        MX, MY, scale = self.meterGeometry()
+
+        meter_left, meter_right, peak_left, peak_right = meter
         
-        pygame.draw.rect(self.context.output, COLORS[0], (MX -1, MY -1, math.floor(100 * scale) +2, 9))
+        pygame.draw.rect(self.context.output, COLORS[0], self.meterRect())
         pygame.draw.rect(self.context.output, COLORS[5], (MX,    MY,    meter_left * scale, 3))
         pygame.draw.rect(self.context.output, COLORS[5], (MX,    MY +4, meter_right * scale, 3))
             
@@ -201,9 +394,14 @@ class MainScreen(wurolib.Screen):
             pygame.draw.rect(self.context.output, COLORS[14 if peak_right < 99 else 10], (math.floor(MX + peak_right * scale), MY +4, 1, 3))
 
     def event(self, event):
-        if event.type == pygame.KEYDOWN:
+        if event.type == pygame.KEYDOWN and self.jumpQuery is not None:
+            self.jumpEvent(event)
+
+        elif event.type == pygame.KEYDOWN:
             if event.key in (pygame.K_SPACE, pygame.K_RIGHT):
                 self.nextPage()
+            elif event.key == pygame.K_TAB:
+                self.startJump()
             elif event.key == pygame.K_LEFT:
                 self.prevPage()
 
@@ -250,7 +448,11 @@ class MainScreen(wurolib.Screen):
 
     def selectPage(self, pagename):
         if pagename.strip() in pages:
+            if pagename.strip() != self.currentPage:
+                self.cancelScheduled()
+
             self.currentPage = pagename.strip()
+            prefetchPage(self.currentPage)
             
             if DEBUG:
                 print('selected page', self.currentPage)
@@ -269,112 +471,113 @@ class MainScreen(wurolib.Screen):
             showError('page %s not found' % pagename.strip())
 
     def nextPage(self):
-        pagenames = list(pages.keys())
-        index = pagenames.index(self.currentPage) +1
+        pagename = pageIndex.next(self.currentPage)
 
-        try:
-            pagename = pagenames[index]
+        if pagename is not None:
             self.selectPage(pagename)
-        except:
+        else:
             showError('already on last page')
 
     def prevPage(self):
-        pagenames = list(pages.keys())
-        index = pagenames.index(self.currentPage) -1
-
-        if index < 0:
-            index = 0
+        pagename = pageIndex.prev(self.currentPage)
 
-        try:
-            pagename = pagenames[index]
+        if pagename is not None:
             self.selectPage(pagename)
-        except:
+        else:
             showError('already on first page')
-            
-    def runCommand(self, cmd):
-        cmds = cmd.split()
-        
-        wait = False
-        cmdQueue = []
-        
-        for cmd in cmds:
-            if cmd.startswith('mute'):
-                _cmd, channels = cmd.split('=')
-                channels = channels.split(',')
 
-                for channel in channels:
-                    cmdQueue.append((midiThread.sendMute, int(channel)))
-                
-            elif cmd.startswith('unmute'):
-                _cmd, channels = cmd.split('=')
-                channels = channels.split(',')
+    def startJump(self):
+        self.jumpQuery = ''
+        self.jumpMatch = 0
+
+    def stopJump(self):
+        self.jumpQuery = None
+
+    def getJumpMatches(self):
+        return pageIndex.find(self.jumpQuery)
+
+    def jumpEvent(self, event):
+        if event.key == pygame.K_TAB:
+            self.stopJump()
+
+        elif event.key == pygame.K_BACKSPACE:
+            if self.jumpQuery:
+                self.jumpQuery = self.jumpQuery[:-1]
+                self.jumpMatch = 0
+            else:
+                self.stopJump()
+
+        elif event.key in (pygame.K_UP, pygame.K_DOWN):
+            matches = self.getJumpMatches()
+            if matches:
+                step = 1 if event.key == pygame.K_DOWN else -1
+                self.jumpMatch = (self.jumpMatch + step) % len(matches)
+
+        elif event.key == pygame.K_RETURN:
+            matches = self.getJumpMatches()
+            self.stopJump()
 
-                for channel in channels:
-                    cmdQueue.append((midiThread.sendUnmute, int(channel)))
+            if matches:
+                self.selectPage(matches[self.jumpMatch % len(matches)])
+
+        elif event.unicode and event.unicode.isprintable():
+            self.jumpQuery += event.unicode
+            self.jumpMatch = 0
             
-            elif cmd.startswith('only'):
-                _cmd, channels = cmd.split('=')
-                channels = channels.split(',')
-                
-                unmutes = [int(c) for c in channels]
-                mutes = list(range(1,17))
-                for c in unmutes:
-                    mutes.remove(c)
-                
-                for c in unmutes:
-                    cmdQueue.append((midiThread.sendUnmute, c))
-                for c in mutes:
-                    cmdQueue.append((midiThread.sendMute, c))
-                        
-            elif cmd.startswith('not'):
-                _cmd, channels = cmd.split('=')
-                channels = channels.split(',')
-                
-                mutes = [int(c) for c in channels]
-                unmutes = list(range(1,17))
-                for c in mutes:
-                    unmutes.remove(c)
-                
-                for c in unmutes:
-                    cmdQueue.append((midiThread.sendUnmute, c))
-                for c in mutes:
-                    cmdQueue.append((midiThread.sendMute, c))
-                        
-            elif cmd.startswith('next'):
-                if not midiThread.sendNextSequence():
-                    showError('%s failed' % cmd)
-
-            elif cmd.startswith('prev'):
-                if not midiThread.sendPrevSequence():
-                    showError('%s failed' % cmd)
-                    
-            elif cmd.startswith('wait'):
-                wait = True
-                self.sendCommands(cmdQueue)
-                cmdQueue = []
-
-            elif cmd.startswith('console'):
-                toggleConsole()
-                
+    def runCommand(self, program):
+        if midiThread is None:
+            showError('midi not ready')
+            return
+
+        for step, arg in program.steps:
+            if step == STEP_SEND:
+                self.sendCommands(arg)
+
+            elif step == STEP_CALL:
+                func, name = arg
+                if func() is False:
+                    showError('%s failed' % name)
         
-        if not wait:
-            self.sendCommands(cmdQueue)
-        else:
-            self.cmdQueue = cmdQueue
-            self.cmdQueuePage = self.currentPage
+        if not program.wait:
+            self.sendCommands(program.queued)
+            return
+
+        # the new program replaces the one still waiting
+        self.cancelScheduled()
+
+        if program.quantize:
+            unit, count = program.quantize
+            deadline = midiThread.clock.nextBoundary(unit, count, time.monotonic())
+
+            if deadline is not None:
+                # sent from the scheduler thread right on the beat
+                self.cmdTimer = scheduler.callAt(deadline, self.sendCommands, program.queued)
+                self.cmdQueue.clear()
+                return
+
+            showError('no midi clock, waiting for sync')
+
+        self.cmdQueue = list(program.queued)
+        self.cmdQueuePage = self.currentPage
             
+    def cancelScheduled(self):
+        if self.cmdTimer:
+            self.cmdTimer.cancel()
+            self.cmdTimer = None
+
     def sendCommands(self, queue):
         if DEBUG:
             print('%s queued commands' % len(queue))
             
-        for cmd, arg in set(queue):
-            if not cmd(arg):
-                showError('%s(%s) failed' % (cmd.__name__, arg))
+        for cmd, args in queue:
+            if not cmd(*args):
+                showError('%s%s failed' % (cmd.__name__, args))
 
     def sync(self):
         if DEBUG:
             print('received sync')
 
+        self.cmdQueueDepth.observe(len(self.cmdQueue))
         self.sendCommands(self.cmdQueue)
         self.cmdQueue.clear()
 
@@ -382,78 +585,227 @@ class MainScreen(wurolib.Screen):
 # --
 
 
-class PlayScreen(wurolib.Screen):
-    def __init__(self, context):
-        super().__init__(context)
+class PlayScreen(DirtyScreen):
+    def __init__(self, context, textCache):
+        super().__init__(context, textCache)
+
+        self.recordings = ()
+        self.version = None
+        self.selected = None    # name of the selected recording
+        self.scrollTop = 0
+
+        self.renderedView = None
+        self.renderedSelection = None
+        self.renderedStatus = None
+
+    def nextRedraw(self, last):
+        if audioThread.getPlayPosition() is None and self.renderedStatus == '':
+            return None
+
+        # the position is updated a few times per second while playing
+        return last + 0.25
+
+    def visibleRows(self):
+        return LAST_LINE    # the last line holds the play button
+
+    def update(self):
+        # takes over the list of the recordings index, if it changed
+        version, recordings = recordingIndex.getRecordings()
+        if version != self.version:
+            self.version = version
+            self.recordings = recordings
+            self.scrollTo(self.getSelectedIndex())
+
+    def getSelectedIndex(self):
+        for i, recording in enumerate(self.recordings):
+            if recording.name == self.selected:
+                return i
+
+        return None
+
+    def getSelected(self):
+        i = self.getSelectedIndex()
+        return self.recordings[i] if i is not None else None
 
-        self.selectedFile = None
-        self.playingFile = None
+    def select(self, i):
+        if not self.recordings:
+            return
 
-        self.fileList = self.getFiles()
+        i = max(0, min(i, len(self.recordings) -1))
+        self.selected = self.recordings[i].name
+        self.scrollTo(i)
+
+    def scrollTo(self, i):
+        rows = self.visibleRows()
+        maxTop = max(0, len(self.recordings) - rows)
+
+        if i is not None:
+            if i < self.scrollTop:
+                self.scrollTop = i
+            elif i >= self.scrollTop + rows:
+                self.scrollTop = i - rows +1
+
+        self.scrollTop = max(0, min(self.scrollTop, maxTop))
 
     def render(self):
-        self.context.fill(COLORS[6])
+        self.update()
+
+        view = (self.version, self.scrollTop)
+        if view != self.renderedView:
+            self.renderedView = view
+            self.invalidate()
+
+        selection = self.getSelectedIndex()
+
+        status = self.getStatus()
 
-        self.drawFiles()
-        self.drawPlayButton()
+        if self.fullRedraw:
+            self.context.fill(COLORS[6])
+
+            self.drawFiles(selection)
+            self.drawPlayButton()
+            self.drawStatus(status)
+
+        else:
+            if selection != self.renderedSelection:
+                for i in (self.renderedSelection, selection):
+                    if i is not None:
+                        self.drawFile(i, selection)
+                        self.markDirty(rowRect(i - self.scrollTop))
+
+            if status != self.renderedStatus:
+                self.drawStatus(status)
+                self.markDirty(textRect(0, LAST_LINE, self.statusWidth()))
+
+        self.renderedSelection = selection
+        self.renderedStatus = status
 
     def event(self, event):
         if event.type == pygame.KEYDOWN:
+            i = self.getSelectedIndex()
+
             if event.key == pygame.K_DOWN:
-                if self.selectedFile is None:
-                    self.selectedFile = -1
-                
-                self.selectedFile += 1
-                self.selectedFile %= len(self.fileList)
+                self.select(0 if i is None else (i +1) % len(self.recordings))
 
             elif event.key == pygame.K_UP:
-                if self.selectedFile is None:
-                    self.selectedFile = len(self.fileList)
-                
-                self.selectedFile -= 1
-                self.selectedFile %= len(self.fileList)
+                self.select(len(self.recordings) -1 if i is None else (i -1) % len(self.recordings))
+
+            elif event.key == pygame.K_PAGEDOWN:
+                self.select((i or 0) + self.visibleRows())
+
+            elif event.key == pygame.K_PAGEUP:
+                self.select((i or 0) - self.visibleRows())
+
+            elif event.key == pygame.K_HOME:
+                self.select(0)
+
+            elif event.key == pygame.K_END:
+                self.select(len(self.recordings) -1)
+
+            elif event.key == pygame.K_s:
+                if recordingIndex.sortOrder == SORT_DATE:
+                    recordingIndex.setSortOrder(SORT_NAME)
+                else:
+                    recordingIndex.setSortOrder(SORT_DATE)
 
             elif event.key == pygame.K_RETURN:
-                audioThread.startPlaying(self.fileList[self.selectedFile])
+                self.play()
 
-    def getFiles(self):
-        path = getPath()
-        
-        filenames = os.listdir(path)
+            elif event.key == pygame.K_SPACE:
+                audioThread.pausePlaying()
 
-        files = []
-        for fn in filenames:
-            if fn.endswith('.wav'):
-                files.append(fn)
-        
-        return files
+            elif event.key == pygame.K_LEFT:
+                audioThread.seekPlaying(-SEEK_STEP, relative=True)
 
-    def drawFiles(self):
-        self.context.locate(0, 0)
+            elif event.key == pygame.K_RIGHT:
+                audioThread.seekPlaying(SEEK_STEP, relative=True)
 
-        for i, filename in enumerate(self.fileList):
-            self.context.print(filename, x=0, fgcolor=COLORS[5 if i != self.selectedFile else 1], bgcolor=COLORS[0])
-            
-            if i == self.selectedFile:
-                self.playingFile = os.path.join(getPath(), filename)
+        elif event.type == pygame.MOUSEBUTTONUP:
+            xpos, ypos = getMousePos(event)
+            row = int(ypos // FONT_H)
+
+            if row >= LAST_LINE:
+                if xpos > SCR_W - FONT_W * 7:
+                    self.play()
+
+            elif self.scrollTop + row < len(self.recordings):
+                self.select(self.scrollTop + row)
+
+    def play(self):
+        recording = self.getSelected()
+        if not recording:
+            return
+
+        position = audioThread.getPlayPosition()
+        if position is not None and position[0] == recording.path:
+            audioThread.pausePlaying()
+        else:
+            audioThread.startPlaying(recording.path)
+
+    def statusWidth(self):
+        return SCR_W // FONT_W - 8     # up to the play button
+
+    def getStatus(self):
+        position = audioThread.getPlayPosition()
+        if position is None:
+            return ''
+
+        path, seconds, duration, paused = position
+        return '%s %i:%02i/%i:%02i' % ('||' if paused else '>',
+                                       *divmod(int(seconds), 60),
+                                       *divmod(int(duration), 60))
+
+    def drawStatus(self, status):
+        self.drawText(status.ljust(self.statusWidth()), 0, LAST_LINE, COLORS[1], COLORS[6])
+
+    def drawFiles(self, selection):
+        last = min(len(self.recordings), self.scrollTop + self.visibleRows())
+
+        for i in range(self.scrollTop, last):
+            self.drawFile(i, selection)
+
+    def drawFile(self, i, selection):
+        recording = self.recordings[i]
+        width = SCR_W // FONT_W
+
+        label = recording.name[:-len('.wav')]
+        if label.startswith('rec-'):
+            label = label[len('rec-'):]
+
+        if recording.duration is not None:
+            minutes, seconds = divmod(int(recording.duration), 60)
+            duration = '%i:%02i' % (minutes, seconds)
+        else:
+            duration = '?'
+
+        label = label[:width - len(duration) -1]
+        text = label + ' ' * (width - len(label) - len(duration)) + duration
+
+        self.drawText(text, 0, i - self.scrollTop, COLORS[5 if i != selection else 1], COLORS[0])
 
     def drawPlayButton(self):
-        self.context.print(' PLAY ', x=SCR_W//FONT_W - 7, y=LAST_LINE, fgcolor=COLORS[1], bgcolor=COLORS[14])
+        self.drawText(' PLAY ', SCR_W//FONT_W - 7, LAST_LINE, COLORS[1], COLORS[14])
 
 
 # --
 
 
-class ShutdownScreen(wurolib.Screen):
-    def __init__(self, context):
-        super().__init__(context)
+class ShutdownScreen(DirtyScreen):
+    def __init__(self, context, textCache):
+        super().__init__(context, textCache)
+
+    def nextRedraw(self, last):
+        return None
 
     def render(self):
+        if not self.fullRedraw:
+            return
+
         self.context.fill(COLORS[6])
 
-        self.context.center('REALLY SHUTDOWN?', y=3, fgcolor=COLORS[1], bgcolor=COLORS[2])
-        self.context.print(' YES ', x=5, y=6, fgcolor=COLORS[1], bgcolor=COLORS[11])
-        self.context.print(' NO  ', x=SCR_W//FONT_W - 10, y=6, fgcolor=COLORS[1], bgcolor=COLORS[11])
+        self.centerText('REALLY SHUTDOWN?', 3, COLORS[1], COLORS[2])
+        self.drawText(' YES ', 5, 6, COLORS[1], COLORS[11])
+        self.drawText(' NO  ', SCR_W//FONT_W - 10, 6, COLORS[1], COLORS[11])
 
     def event(self, event):
         if event.type == pygame.KEYDOWN:
@@ -487,24 +839,46 @@ def consoleCommands(cmd):
         return
 
     if cmd == 'help':
-        print('pages')
+        print('pages [SEARCH]')
         print('show [PAGE]')
         print('rec')
         print('play')
+        print('pause')
+        print('seek SECONDS')
+        print('midicap [FILE]')
+        print('timing')
+        print('metrics [PREFIX|reset]')
         print('stop')
         print('size [N]')
+        print('cache')
         print('debug')
         print('exit/quit/bye')
 
     elif cmd == 'pages':
-        for pagename in list(pages.keys()):
+        if args:
+            pagenames = pageIndex.find(args[0])
+        else:
+            pagenames = pageIndex
+
+        for pagename in pagenames:
             print('- %s' % pagename)
             
     elif cmd == 'show':
-        if args:
+        if not args:
+            mainScreen.selectPage('DEFAULT')
+        elif args[0] in pageIndex:
             mainScreen.selectPage(args[0])
         else:
-            mainScreen.selectPage('DEFAULT')
+            matches = pageIndex.find(args[0])
+
+            if len(matches) == 1:
+                mainScreen.selectPage(matches[0])
+            elif matches:
+                print('%i pages match:' % len(matches))
+                for pagename in matches:
+                    print('- %s' % pagename)
+            else:
+                mainScreen.selectPage(args[0])
 
     elif cmd in ('exit', 'quit', 'bye'):
         print('good bye.')
@@ -514,15 +888,27 @@ def consoleCommands(cmd):
         audioThread.startRecording()
 
     elif cmd == 'play':
-        if playScreen.fileList:
-            if playScreen.selectedFile is not None:
-                audioThread.startPlaying(playScreen.fileList[playScreen.selectedFile])
-            else:
+        playScreen.update()
+
+        if playScreen.recordings:
+            recording = playScreen.getSelected()
+            if recording is None:
                 print('no file selected, playing first one')
-                audioThread.startPlaying(playScreen.fileList[0])
+                recording = playScreen.recordings[0]
+
+            audioThread.startPlaying(recording.path)
         else:
             print('no files available')
 
+    elif cmd == 'pause':
+        audioThread.pausePlaying()
+
+    elif cmd == 'seek':
+        try:
+            audioThread.seekPlaying(float(args[0]))
+        except (IndexError, ValueError):
+            print('usage: seek SECONDS')
+
     elif cmd == 'stop':
         audioThread.stopRecording()
         audioThread.stopPlaying()
@@ -552,6 +938,50 @@ def consoleCommands(cmd):
 
         mainApp.setScreen(consoleScreen)
 
+    elif cmd == 'midicap':
+        if midiThread is None:
+            print('midi not ready')
+        elif args:
+            try:
+                midiThread.startCapture(MidiRecorder(args[0]))
+                print('capturing midi input to %s' % args[0])
+            except OSError as e:
+                print('could not capture midi input:', e)
+        else:
+            midiThread.stopCapture()
+
+    elif cmd == 'timing':
+        if midiThread:
+            tempo = midiThread.clock.getTempo()
+            print('midi clock: %s' % ('%.1f bpm' % tempo if tempo else 'none'))
+
+        stats = scheduler.stats()
+        print('scheduled: %i sent, %i pending' % (stats['calls'], scheduler.pending()))
+
+        if stats['lateness']:
+            print('late: %.2f avg, %.2f p95, %.2f max ms' % stats['lateness'])
+            print('send: %.2f avg, %.2f p95, %.2f max ms' % stats['duration'])
+
+    elif cmd == 'metrics':
+        if args and args[0] == 'reset':
+            metrics.registry.reset()
+            print('metrics reset')
+        else:
+            for line in metrics.registry.format(args[0] if args else ''):
+                print(line)
+
+    elif cmd == 'cache':
+        stats = textCache.stats()
+        print('text: %(lines)i lines, %(atlases)i colors' % stats)
+        print('text: %(hits)i hits, %(misses)i misses' % stats)
+        print('pages: %i surfaces' % len(pageSurfaces.entries))
+        print('pages: %i hits, %i misses' % (pageSurfaces.hits, pageSurfaces.misses))
+
+        if pageLibrary:
+            stats = pageLibrary.stats()
+            print('library: %(resident)i of %(pages)i pages loaded' % stats)
+            print('library: %(hits)i hits, %(misses)i misses' % stats)
+
     elif cmd == 'debug':
         global DEBUG
         DEBUG = not DEBUG
@@ -567,34 +997,45 @@ mainScreen = None
 playScreen = None
 shutdownScreen = None
 consoleScreen = None
+textCache = None
 
 def initScreens(fontzoom=1):
     global mainScreen, playScreen, shutdownScreen, consoleScreen
-    global currentScreen
+    global currentScreen, textCache
         
-    font = wurolib.BitmapFont(filename='gfx/moonfont.png',
+    font = wurolib.BitmapFont(filename=FONT_FILE,
                               char_w=FONT_W, char_h=FONT_H,
                               zoom=fontzoom,
                               )
     
-    for color in COLORS:
-        font.initColor(color)
+    # only the console draws text through the font itself, the other
+    # screens use the text cache, which colors its glyphs on demand
+    font.initColor(COLORS[1])
 
     context = wurolib.initContext(SCR_W, SCR_H, title='prompter', font=font)
 
-    mainScreen = MainScreen(context)
-    playScreen = PlayScreen(context)
-    shutdownScreen = ShutdownScreen(context)
+    textCache = TextCache(FONT_FILE, FONT_W, FONT_H, zoom=fontzoom, maxLines=TEXT_CACHE_SIZE)
+
+    previous = mainScreen
+
+    mainScreen = MainScreen(context, textCache)
+    playScreen = PlayScreen(context, textCache)
+
+    # a page library usually has no DEFAULT page
+    if previous and previous.currentPage in pages:
+        mainScreen.currentPage = previous.currentPage
+    elif pages and not mainScreen.currentPage in pages:
+        mainScreen.currentPage = next(iter(pageIndex))
+    shutdownScreen = ShutdownScreen(context, textCache)
     consoleScreen = wurolib.Console(context, wrap=True, interactive=True, callback=consoleCommands, bgcolor=(0, 0, 0, 128))
 
     currentScreen = mainScreen
 
-    global LAST_LINE
+    global LAST_LINE, FONT_ZOOM
     LAST_LINE = SCR_H // FONT_H -1
+    FONT_ZOOM = fontzoom
 
 
-initScreens()
-
 showConsole = False
 def toggleConsole():
     global showConsole
@@ -625,50 +1066,152 @@ def switchToShutdown():
     
 def pageCallback(pagename):
     mainScreen.selectPage(pagename)
+    mainApp.wake()
 
 def syncCallback():
     mainScreen.sync()
+    mainApp.wake()
+
+
+# -- initialization
+
+ioLoop = None
+worker = None           # blocking file i/o, off the io loop which polls midi
+scheduler = None
+midiThread = None
+audioThread = None
+mainApp = None
+pagesWatcher = None
+recordingIndex = None
+recordingsWatcher = None
+metricsExporter = None
 
+def refreshRecordings():
+    # called in the worker thread, the play screen picks up the new list
+    # when it is rendered
+    if recordingIndex.refresh():
+        mainApp.wake()
 
-# -- initialization of threads and pages
+def initMidi():
+    # midi devices take a while to initialize, this runs in the background
+    # while the first page is already shown
+    timer = StartupTimer('midi')
 
-loadData()
+    if not waitForDevices(MIDI_WAIT):
+        print('midi interface not found after %i s' % MIDI_WAIT)
+    timer.phase('wait ports')
 
-midiThread = MidiThread(pageCallback=pageCallback, syncCallback=syncCallback)
-midiThread.start()
+    midi = MidiThread(ioLoop, pageCallback=pageCallback, syncCallback=syncCallback, latency=MIDI_LATENCY, coalesce=PAGE_COALESCE)
+    timer.phase('devices')
 
-audioThread = AudioThread(outPath=getPath())
-audioThread.start()
+    mainApp.callSoon(startMidi, midi)
+    timer.report()
 
-if not midiThread.midi_in:
-    showError('no midi input device')
+def startMidi(midi):
+    global midiThread
 
+    midiThread = midi
+    bindCommands(pageCmds)
+    midiThread.start()
 
-# -- main app
+    if not midiThread.midi_in:
+        showError('no midi input device')
 
-mainApp = wurolib.MainApp()
+def main():
+    global ioLoop, worker, scheduler, audioThread, mainApp, pagesWatcher
+    global recordingIndex, recordingsWatcher, metricsExporter
 
-mainApp.setScreen(currentScreen)
+    timer = StartupTimer('startup', start=startTime)
+    timer.phase('imports')
 
-mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F11, pygame.display.toggle_fullscreen)
-mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F12, toggleConsole)
+    initScreens()
+    timer.phase('display')
 
-mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F1, switchToMain)
-mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F2, switchToPlay)
-mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_ESCAPE, switchToShutdown)
+    loadData()
+    timer.phase('pages')
 
-if DEBUG:
-    toggleConsole()
+    ioLoop = IOLoop()
+    ioLoop.start()
 
-try:
-    mainApp.run()
-finally:
-    import traceback
+    worker = Worker()
+    worker.start()
 
-    with open('prompter.log', 'w') as f:
-        f.writelines(['%s\n' % line for line in wurolib.printLog])
-        f.write(traceback.format_exc())
+    scheduler = Scheduler()
+    scheduler.start()
 
-    midiThread.stop()
-    audioThread.stop()
+    metrics.registry.gauge('commands.scheduled', scheduler.pending)
 
+    if METRICS_EXPORT:
+        try:
+            metricsExporter = metrics.Exporter(ioLoop, metrics.registry, METRICS_EXPORT, METRICS_INTERVAL)
+            metricsExporter.start()
+        except (OSError, ValueError) as e:
+            print('could not export metrics:', e)
+
+    audioThread = AudioThread(ioLoop, outPath=getPath(), meterRate=METER_RATE, useProcess=AUDIO_PROCESS,
+                              playDevice=PLAY_DEVICE, preRoll=PRE_ROLL, preallocate=PREALLOCATE,
+                              onPlayFinished=lambda: mainApp.wake())
+
+    mainApp = PrompterApp()
+
+    mainApp.setScreen(currentScreen)
+
+    mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F11, pygame.display.toggle_fullscreen)
+    mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F12, toggleConsole)
+
+    mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F1, switchToMain)
+    mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_F2, switchToPlay)
+    mainApp.registerGlobalEvent(pygame.KEYDOWN, pygame.K_ESCAPE, switchToShutdown)
+
+    def firstFrame():
+        timer.phase('first frame')
+        timer.report()
+
+        uptime = getUptime()
+        if uptime is not None:
+            print('startup: first frame %.1f s after boot' % uptime)
+
+        # the rest starts once the first page is visible
+        audioThread.start()
+        prefetchPage(mainScreen.currentPage)
+        worker.submit(refreshRecordings)
+        threading.Thread(target=initMidi, name='midi init', daemon=True).start()
+
+    mainApp.onFirstFrame = firstFrame
+
+    if pageLibrary:
+        pagesWatcher = FileWatcher(ioLoop, getLibraryPath(), reloadLibrary, worker)
+    else:
+        pagesWatcher = FileWatcher(ioLoop, getPagesPath(), reloadData, worker)
+    pagesWatcher.start()
+
+    recordingIndex = RecordingIndex(getPath())
+    recordingsWatcher = FileWatcher(ioLoop, getPath(), refreshRecordings, worker)
+    recordingsWatcher.start()
+
+    if DEBUG:
+        toggleConsole()
+
+    try:
+        mainApp.run()
+    finally:
+        import traceback
+
+        with open('prompter.log', 'w') as f:
+            f.writelines(['%s\n' % line for line in wurolib.printLog])
+            f.write(traceback.format_exc())
+
+        pagesWatcher.stop()
+        recordingsWatcher.stop()
+        if midiThread:
+            midiThread.stop()
+        audioThread.stop()
+        scheduler.stop()
+        worker.stop()
+        if metricsExporter:
+            metricsExporter.stop()
+        ioLoop.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import collections
+import time
+
+import pygame
+import wurolib
+
+import metrics
+
+
+FRAME_RATE = 30     # upper limit for the number of frames per second
+
+WAKE_EVENT = pygame.event.custom_type()
+
+
+class PrompterApp(wurolib.MainApp):
+    """main loop which pushes only the changed parts of the screen to the
+    display, for screens that keep track of them (see render.DirtyScreen),
+    and which only renders when there is something new to show.
+
+    screens can implement nextRedraw(last) to return the time at which they
+    have to be redrawn next, given the time of the last frame, or None if
+    they only change on events. screens without it are redrawn at the full
+    frame rate"""
+
+    def __init__(self):
+        super().__init__()
+
+        self.active = False
+        self.hotkeys = {}
+
+        self.lastFrame = 0
+        self.pendingEvents = True
+
+        self.calls = collections.deque()
+
+        self.onFirstFrame = None    # called once the first frame is shown
+
+        self.frameInterval = metrics.registry.histogram('frame.interval')
+        self.renderTimes = {}       # histograms by screen class
+
+    def registerGlobalEvent(self, eventType, key, func):
+        super().registerGlobalEvent(eventType, key, func)
+        self.hotkeys[(eventType, key)] = func
+
+    def setScreen(self, screen):
+        super().setScreen(screen)
+
+        if hasattr(screen, 'invalidate'):
+            screen.invalidate()
+
+        self.pendingEvents = True
+
+    def quit(self):
+        self.active = False
+        super().quit()
+
+    def wake(self):
+        """requests a redraw, may be called from other threads"""
+        pygame.event.post(pygame.event.Event(WAKE_EVENT))
+
+    def callSoon(self, func, *args):
+        """runs func in the main loop, may be called from other threads"""
+        self.calls.append((func, args))
+        self.wake()
+
+    def handleEvent(self, event):
+        if event.type == WAKE_EVENT:
+            while self.calls:
+                func, args = self.calls.popleft()
+                func(*args)
+            return
+
+        if event.type == pygame.NOEVENT:
+            return
+
+        if event.type == pygame.QUIT:
+            self.quit()
+            return
+
+        func = self.hotkeys.get((event.type, getattr(event, 'key', None)))
+        if func:
+            func()
+        else:
+            self.getScreen().event(event)
+
+    def present(self, screen):
+        if hasattr(screen, 'takeDirtyRects'):
+            rects = screen.takeDirtyRects()
+        else:
+            rects = None
+
+        if rects is None:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+
+    def nextFrameTime(self, screen, now):
+        earliest = self.lastFrame + 1 / FRAME_RATE
+
+        if self.pendingEvents:
+            return earliest
+
+        if hasattr(screen, 'nextRedraw'):
+            # relative to the last frame, a deadline after now would never
+            # be reached
+            deadline = screen.nextRedraw(self.lastFrame)
+            if deadline is None:
+                return None
+        else:
+            deadline = earliest
+
+        return max(deadline, earliest)
+
+    def run(self):
+        self.active = True
+
+        while self.active:
+            screen = self.getScreen()
+
+            now = time.time()
+            due = self.nextFrameTime(screen, now)
+
+            if due is None or due > now:
+                if due is None:
+                    event = pygame.event.wait()
+                else:
+                    event = pygame.event.wait(max(1, int((due - now) * 1000)))
+
+                if event.type == pygame.NOEVENT:
+                    continue
+
+                for event in [event] + pygame.event.get():
+                    self.handleEvent(event)
+
+                    if not self.active:
+                        return
+
+                self.pendingEvents = True
+                continue
+
+            self.pendingEvents = False
+
+            if self.lastFrame:
+                self.frameInterval.observe((now - self.lastFrame) * 1000)
+
+            self.lastFrame = now
+
+            start = time.perf_counter()
+
+            screen.render()
+            self.present(screen)
+
+            renderTime = self.renderTimes.get(type(screen))
+            if renderTime is None:
+                renderTime = metrics.registry.histogram('render.' + type(screen).__name__)
+                self.renderTimes[type(screen)] = renderTime
+
+            renderTime.observe((time.perf_counter() - start) * 1000)
+
+            if self.onFirstFrame:
+                onFirstFrame, self.onFirstFrame = self.onFirstFrame, None
+                onFirstFrame()
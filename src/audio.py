@@ -1,20 +1,63 @@
+import multiprocessing
 import threading
-import subprocess
 import time
 import os
 
 from wurolib import print
 
+from meter import toPercent
+from capture import CaptureEngine, MeterSnapshot, captureMain
+from playback import Player
+
+import metrics
+
 
 class AudioThread():
-    def __init__(self, outPath):
+    """records and plays back audio, with the i/o handled by the given
+    ioloop.IOLoop; with useProcess=True capture and metering run in a
+    separate process, which publishes the meter levels through shared
+    memory, so they do not compete with the ui for the GIL"""
+
+    def __init__(self, loop, outPath, meterRate=20, useProcess=False, playDevice='default', preRoll=0, preallocate=0, onPlayFinished=None):
         self.outPath = outPath
+        self.preRoll = preRoll
 
+        self.loop = loop
         self.running = False
-        self.process = None
-        self.playProcess = None
+        self.player = Player(device=playDevice, onFinished=onPlayFinished)
+
+        self.useProcess = useProcess
+        self.meterRate = meterRate
+
+        if useProcess:
+            # started from a fresh interpreter, forking would copy SDL and
+            # the threads already running in this process
+            context = multiprocessing.get_context('spawn')
+
+            self.snapshot = MeterSnapshot(context)
+            self.conn, childConn = context.Pipe()
+            self.captureProcess = context.Process(target=captureMain,
+                                                  args=(childConn, self.snapshot, meterRate, preRoll, preallocate),
+                                                  daemon=True)
+            self.commandSeq = 0
+            self.recording = False
+            self.captureAlive = False
+
+            # copies of the statistics of the capture process
+            meterUpdates = metrics.Counter()
+            readSizes = metrics.Histogram(metrics.SIZE_BUCKETS)
+            metrics.registry.addCollector(self._collectStats)
+        else:
+            self.engine = CaptureEngine(meterRate=meterRate, publish=self._publish, preRoll=preRoll,
+                                        preallocate=preallocate)
+            self.levels = self.engine.meter.getLevels()
+            self.recordLock = threading.Lock()
 
-        self.thread = threading.Thread(target=self._run)
+            meterUpdates = self.engine.meterUpdates
+            readSizes = self.engine.readSizes
+
+        metrics.registry.add('audio.meter.updates', meterUpdates)
+        metrics.registry.add('audio.read.bytes', readSizes)
 
         self.meter_left = 0
         self.meter_right = 0
@@ -23,66 +66,90 @@ class AudioThread():
         
     def start(self):
         self.running = True
-        self.thread.start()
+
+        if self.useProcess:
+            self.captureProcess.start()
+            self.captureAlive = True
+            self.loop.watchSentinel(self.captureProcess.sentinel, self._captureExited)
+
+        elif self.preRoll:
+            with self.recordLock:
+                try:
+                    self.engine.arm()
+                except OSError as e:
+                    print('could not start capturing:', e)
+                    return
+
+                process = self.engine.process
+
+            self.loop.addReader(process.stdout, self._readable, process)
             
     def stop(self):
         self.running = False
 
-    def _run(self):
-        import select
-        while self.running:
-            buf = b''
-            while self.running:
-                if self.process:
-                    select.select([self.process.stderr], [], [])
-                    if not self.process:
-                        break
-                        
-                    data = self.process.stderr.read()
-                    if data == b'':
-                        break
-
-                    buf = buf + data
-                    while self.running:
-                        line, sep, buf = buf.partition(b'\r')
-                        if not sep:
-                            buf = line
-                            break
-                        
-                        try:
-                            line = str(line)
-                            p1, p2 = line.split('|')
-                            
-                            val1 = p1.count('#') * 100/35
-                            val2 = p2.count('#') * 100/35
-                            
-                            center = line.find('|')
-                            peak1 = line[center-4:center-1].strip()
-                            peak2 = line[center+1:center+3].strip()
-                            
-                            if peak1 == 'MAX':
-                                peak1 = 100
-                            if peak2 == 'MAX':
-                                peak2 = 100
-                            
-                            self.setMeter(val1, val2, int(peak1), int(peak2))
-                        except Exception as e:
-                            print(e)
-                else:
-                    time.sleep(0.1)
-            
-                continue
-                
-            else:
-                time.sleep(0.1)
-            
-        self.stopRecording()
-        self.stopPlaying()
+        if self.useProcess:
+            self.stopRecording()
+        else:
+            with self.recordLock:
+                writer = self.engine.stopRecording()
+
+                # an armed engine keeps capturing after the recording
+                process = self.engine.process
+                self.engine.stopCapture()
+
+            if process:
+                self.loop.removeReader(process.stdout)
+
+            # the rest of the recording is written before exiting
+            if writer:
+                writer.join()
+
+        self.player.close()
+
+        if self.useProcess and self.captureProcess.is_alive():
+            self._sendCommand('quit')
+            self.captureProcess.join(1)
+
+            if self.captureProcess.is_alive():
+                self.captureProcess.terminate()
+
+    def _captureExited(self):
+        self.captureAlive = False
+
+        if self.running:
+            print('capture process exited unexpectedly')
+
+    def _readable(self, process):
+        with self.recordLock:
+            if process is not self.engine.process or not self.engine.read():
+                # recording was stopped or arecord exited
+                self.loop.removeReader(process.stdout)
+
+    def _publish(self, rms, peak):
+        self.levels = (rms, peak)
+        self.setMeter(toPercent(rms[0]), toPercent(rms[1]), toPercent(peak[0]), toPercent(peak[1]))
+
+    def _collectStats(self):
+        stats = self.snapshot.readStats()
+
+        metrics.registry.metrics['audio.meter.updates'].value = int(stats[0])
+
+        readSizes = metrics.registry.metrics['audio.read.bytes']
+        readSizes.count, readSizes.total, readSizes.max = int(stats[1]), stats[2], stats[3]
+        readSizes.counts = [int(count) for count in stats[4:]]
+
+    def _sendCommand(self, cmd, *args):
+        self.commandSeq += 1
+        self.conn.send((self.commandSeq, cmd) + args)
         
     def startRecording(self):
         if self.isRecording():
             print('ALREADY RECORDING!')
             return
+
+        if self.useProcess and not self.captureAlive:
+            print('capture process is not running')
+            return
         
         date = time.gmtime()
         filename = 'rec-%04i-%02i-%02i_%02i-%02i-%02i.wav' % (date.tm_year,
@@ -93,34 +160,60 @@ class AudioThread():
                                                               date.tm_sec,
                                                               )
         print('start recording:\n%s' % filename)
-        
-        self.process = subprocess.Popen(['arecord',
-                                         '-D', 'hw:1,0',   # device
-                                         '-f', 'cd',       # cd quality
-                                         '-c', '2',        # 2 channels
-                                         '-V', 'stereo',   # VU meter
-                                         os.path.join(self.outPath, filename),
-                                         ],
-                                         stderr=subprocess.PIPE)
-
-        import fcntl
-        fd = self.process.stderr.fileno()
-        fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-        fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+
+        path = os.path.join(self.outPath, filename)
+
+        if self.useProcess:
+            self._sendCommand('record', path)
+            self.recording = True
+        else:
+            with self.recordLock:
+                armed = self.engine.process
+                self.engine.startRecording(path)
+                process = self.engine.process
+
+            # an armed engine is read already
+            if process is not armed:
+                self.loop.addReader(process.stdout, self._readable, process)
 
     def stopRecording(self):
         print('stop recording')
-        if self.process:
-            self.process.kill()
-            self.process = None
-            
-        self.setMeter(0, 0)
+
+        if self.useProcess:
+            if self.captureAlive:
+                self._sendCommand('stop')
+            self.recording = False
+        else:
+            # the file is finished by the writer thread, the lock is only
+            # held while the writer is detached
+            with self.recordLock:
+                self.engine.stopRecording()
     
     def isRecording(self):
-        if self.process:
-            return True
-        else:
-            return False
+        if self.useProcess:
+            if not self.captureAlive:
+                return False
+
+            levels, recording, ack = self.snapshot.read()
+
+            # until the capture process has handled the last command, the
+            # state requested from it is reported
+            if ack < self.commandSeq:
+                return self.recording
+
+            return recording
+
+        return self.engine.isRecording()
+
+    def isMetering(self):
+        """returns True while the meters are live"""
+        if self.useProcess:
+            if self.captureAlive and self.snapshot.read()[2] < self.commandSeq:
+                return True     # the levels change until the last command is handled
+
+            return self.isRecording() or (self.preRoll > 0 and self.captureAlive)
+
+        return self.engine.isCapturing()
         
     def setMeter(self, left, right, peakl=0, peakr=0):
         self.meter_left = left
@@ -130,20 +223,48 @@ class AudioThread():
         self.peak_right = peakr
 
     def getMeter(self):
+        if self.useProcess:
+            levels, recording, ack = self.snapshot.read()
+            return tuple(toPercent(level) for level in levels)
+
         return self.meter_left, self.meter_right, self.peak_left, self.peak_right
+
+    def getMeterDb(self):
+        """returns rms and peak levels per channel in dBFS"""
+        if self.useProcess:
+            levels, recording, ack = self.snapshot.read()
+            return levels[0:2], levels[2:4]
+
+        return self.levels
     
     def startPlaying(self, filename):
         print('start playing', filename)
         if not filename:
             return
-            
-        if self.playProcess:
-            self.playProcess.kill()
-            
-        self.playProcess = subprocess.Popen(['aplay', filename])
-        
+
+        try:
+            self.player.play(filename)
+        except (OSError, ValueError) as e:
+            print('could not play %s: %s' % (filename, e))
+
     def stopPlaying(self):
         print('stop playing')
-        if self.playProcess:
-            self.playProcess.kill()
+        self.player.stop()
+
+    def pausePlaying(self):
+        self.player.togglePause()
+
+    def seekPlaying(self, seconds, relative=False):
+        if relative:
+            position = self.player.getPosition()
+            if position is None:
+                return
+
+            seconds += position[1]
+
+        self.player.seek(seconds)
 
+    def getPlayPosition(self):
+        """returns (path, position, duration, paused), or None if nothing is
+        being played"""
+        return self.player.getPosition()
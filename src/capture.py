@@ -0,0 +1,337 @@
+import multiprocessing
+import subprocess
+import select
+import signal
+import math
+import os
+
+from wurolib import print
+
+from meter import Meter
+from recorder import RecordingWriter
+
+import metrics
+
+
+# format of the recordings, same as arecord -f cd
+
+CHANNELS = 2
+RATE = 44100
+SAMPLE_WIDTH = 2
+
+READ_SIZE = 65536
+
+FRAME_SIZE = CHANNELS * SAMPLE_WIDTH
+
+
+class RingBuffer:
+    """keeps the last size bytes of a stream in preallocated memory"""
+
+    def __init__(self, size):
+        self.size = size
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+        self.pos = 0
+        self.total = 0      # bytes written since the last clear()
+
+    def clear(self):
+        self.pos = 0
+        self.total = 0
+
+    def write(self, data):
+        n = len(data)
+
+        if n >= self.size:
+            self.view[:] = data[n - self.size:]
+            self.pos = 0
+        else:
+            first = min(n, self.size - self.pos)
+            self.view[self.pos:self.pos + first] = data[:first]
+            self.view[:n - first] = data[first:]
+            self.pos = (self.pos + n) % self.size
+
+        self.total += n
+
+    def getParts(self, align=1):
+        """returns the buffered data as memoryviews, oldest first; the data
+        starts on a multiple of align bytes of the stream, so no partial
+        frame is returned"""
+
+        if self.total >= self.size:
+            parts = [self.view[self.pos:], self.view[:self.pos]]
+            skip = (self.size - self.total) % align
+        else:
+            parts = [self.view[:self.pos]]
+            skip = 0
+
+        result = []
+        for part in parts:
+            if skip >= len(part):
+                skip -= len(part)
+                continue
+
+            result.append(part[skip:])
+            skip = 0
+
+        return result
+
+
+class CaptureEngine:
+    """runs arecord, meters the raw pcm data it delivers and has it written
+    to a wave file by a recorder.RecordingWriter; publish is called with
+    the rms and peak levels in dBFS per channel whenever a new measurement
+    is available.
+
+    with preRoll seconds > 0 the engine can be armed, capturing all the
+    time and keeping the last seconds of audio in a ring buffer, which
+    becomes the beginning of the next recording.
+
+    preallocate is the number of seconds of disk space reserved for each
+    recording when it starts"""
+
+    def __init__(self, meterRate=20, publish=lambda rms, peak: None, preRoll=0, preallocate=0):
+        self.meter = Meter(channels=CHANNELS, rate=RATE, updateRate=meterRate)
+        self.publish = publish
+
+        self.process = None
+        self.writer = None
+
+        self.preallocate = int(preallocate * RATE) * FRAME_SIZE
+
+        if preRoll:
+            self.preRoll = RingBuffer(int(preRoll * RATE) * FRAME_SIZE)
+        else:
+            self.preRoll = None
+
+        # arecord's output is read into the same buffer every time
+        self.readBuffer = bytearray(READ_SIZE)
+        self.readView = memoryview(self.readBuffer)
+
+        self.meterUpdates = metrics.Counter()
+        self.readSizes = metrics.Histogram(metrics.SIZE_BUCKETS)
+
+    def isCapturing(self):
+        return self.process is not None
+
+    def isRecording(self):
+        return self.writer is not None
+
+    def fileno(self):
+        return self.process.stdout.fileno()
+
+    def arm(self):
+        """starts capturing into the pre-roll buffer"""
+        if self.preRoll and not self.isCapturing():
+            self.startCapture()
+
+    def startRecording(self, path):
+        writer = RecordingWriter(path, CHANNELS, RATE, SAMPLE_WIDTH, preallocate=self.preallocate)
+
+        if not self.isCapturing():
+            try:
+                self.startCapture()
+            except OSError:
+                writer.close()
+                raise
+
+        elif self.preRoll:
+            for part in self.preRoll.getParts(align=FRAME_SIZE):
+                writer.write(bytes(part))
+
+        self.writer = writer
+
+    def stopRecording(self):
+        """returns the writer of the recording, which finishes writing the
+        file in the background; join() it to wait for that"""
+        writer, self.writer = self.writer, None
+
+        if writer:
+            writer.finish(onClosed=self.reportStats)
+
+        if not self.preRoll:
+            self.stopCapture()
+
+        return writer
+
+    def startCapture(self):
+        # raw pcm data is read from stdout, metered and written to the file
+        process = subprocess.Popen(['arecord',
+                                    '-D', 'hw:1,0',   # device
+                                    '-f', 'cd',       # cd quality
+                                    '-c', '2',        # 2 channels
+                                    '-t', 'raw',      # no header, pcm only
+                                    ],
+                                    stdout=subprocess.PIPE)
+
+        os.set_blocking(process.stdout.fileno(), False)
+
+        self.meter.reset()
+        if self.preRoll:
+            self.preRoll.clear()
+
+        self.process = process
+
+    def stopCapture(self):
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+        self.meter.reset()
+        self.publish(*self.meter.getLevels())
+
+    def reportStats(self, stats):
+        print('recorded %.1f MB, max. %i kB buffered' % (stats['written'] / 1e6, stats['highWater'] // 1024))
+
+        if stats['stalls']:
+            print('%(stalls)i write stalls, longest %(longestWrite).2f s' % stats)
+
+        if stats['dropped']:
+            print('DROPPED %i kB OF AUDIO' % (stats['dropped'] // 1024))
+
+    def getStats(self):
+        """returns the meter updates and read sizes as a flat list of
+        numbers, see MeterSnapshot"""
+        sizes = self.readSizes
+        return [self.meterUpdates.value, sizes.count, sizes.total, sizes.max] + sizes.counts
+
+    def read(self):
+        """reads the data available from arecord; returns False if arecord
+        has exited and the recording was stopped"""
+        try:
+            n = os.readv(self.fileno(), [self.readView])
+        except BlockingIOError:
+            return True
+
+        if not n:
+            self.stopRecording()
+            self.stopCapture()
+            return False
+
+        self.readSizes.observe(n)
+        data = self.readView[:n]
+
+        if self.preRoll:
+            self.preRoll.write(data)
+
+        if self.writer:
+            self.writer.write(bytes(data))
+
+        if self.meter.process(data):
+            self.meterUpdates.inc()
+            self.publish(*self.meter.getLevels())
+
+        return True
+
+
+class MeterSnapshot:
+    """meter levels and recording state in a small block of shared memory,
+    written by the capture process and read by the ui without locking.
+    a sequence counter which is odd while a write is in progress makes
+    readers retry instead of seeing half-written values (seqlock)"""
+
+    # seq, 4 levels, recording flag, acknowledged command, then the
+    # statistics of CaptureEngine.getStats
+    STATS = 7
+    SIZE = STATS + 4 + len(metrics.SIZE_BUCKETS) +1
+
+    def __init__(self, context=multiprocessing):
+        self.values = context.RawArray('d', self.SIZE)
+        self.values[1:5] = [-math.inf] * 4
+
+    def write(self, levels=None, recording=None, ack=None, stats=None):
+        values = self.values
+
+        seq = values[0]
+        values[0] = seq + 1
+
+        if levels is not None:
+            values[1:5] = levels
+        if recording is not None:
+            values[5] = recording
+        if ack is not None:
+            values[6] = ack
+        if stats is not None:
+            values[self.STATS:] = stats
+
+        values[0] = seq + 2
+
+    def readValues(self):
+        values = self.values
+        snapshot = values[:]
+
+        for i in range(100):
+            seq = values[0]
+            if seq % 2:
+                continue
+
+            snapshot = values[:]
+            if values[0] == seq:
+                break
+
+        return snapshot
+
+    def read(self):
+        """returns (levels, recording, ack)"""
+        snapshot = self.readValues()
+        return snapshot[1:5], bool(snapshot[5]), int(snapshot[6])
+
+    def readStats(self):
+        return self.readValues()[self.STATS:]
+
+
+def captureMain(conn, snapshot, meterRate, preRoll=0, preallocate=0):
+    """entry point of the capture process; commands are received through conn
+    as tuples of (seq, command, args...)"""
+
+    # shutdown is requested by the main process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    def publish(rms, peak):
+        snapshot.write(levels=rms + peak, stats=engine.getStats())
+
+    engine = CaptureEngine(meterRate=meterRate, publish=publish, preRoll=preRoll, preallocate=preallocate)
+
+    try:
+        engine.arm()
+    except OSError as e:
+        print('could not start capturing:', e)
+
+    try:
+        while True:
+            sources = [conn]
+            if engine.isCapturing():
+                sources.append(engine)
+
+            readable, _w, _x = select.select(sources, [], [])
+
+            if engine in readable:
+                if not engine.read():
+                    snapshot.write(recording=False)
+
+            if conn in readable:
+                try:
+                    seq, cmd, *args = conn.recv()
+                except EOFError:
+                    break
+
+                if cmd == 'record':
+                    try:
+                        engine.startRecording(*args)
+                    except Exception as e:
+                        print('could not start recording:', e)
+
+                elif cmd == 'stop':
+                    engine.stopRecording()
+
+                elif cmd == 'quit':
+                    break
+
+                snapshot.write(recording=engine.isRecording(), ack=seq)
+    finally:
+        writer = engine.stopRecording()
+        engine.stopCapture()
+
+        if writer:
+            writer.join()
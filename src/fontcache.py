@@ -0,0 +1,92 @@
+import math
+
+import pygame
+
+from render import LRUCache
+
+
+FIRST_CHAR = 32     # the font image holds the glyphs from ' ' on in one row
+
+
+class TextCache:
+    """renders text with the glyphs of a bitmap font image like the one used
+    by wurolib.BitmapFont, caching per color glyph atlases in the display's
+    pixel format and the surfaces of complete lines of text.
+
+    positions are given in character cells, like for wurolib contexts"""
+
+    def __init__(self, filename, char_w, char_h, zoom=1, maxLines=256):
+        self.filename = filename
+        self.zoom = zoom
+
+        self.charW = char_w * zoom
+        self.charH = char_h * zoom
+
+        self.image = None
+        self.atlases = {}
+        self.lines = LRUCache(maxLines)
+
+    def getImage(self):
+        if self.image is None:
+            image = pygame.image.load(self.filename)
+            width, height = image.get_size()
+            self.image = pygame.transform.scale(image, (width * self.zoom, height * self.zoom))
+
+        return self.image
+
+    def getAtlas(self, color):
+        try:
+            return self.atlases[color]
+        except KeyError:
+            pass
+
+        # the glyphs are white, so multiplying tints them
+        atlas = self.getImage().convert_alpha()
+        atlas.fill(tuple(color[:3]) + (255,), special_flags=pygame.BLEND_RGBA_MULT)
+
+        self.atlases[color] = atlas
+        return atlas
+
+    def renderLine(self, text, fgcolor, bgcolor):
+        size = (max(len(text), 1) * self.charW, self.charH)
+
+        if bgcolor is None:
+            surface = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+            surface.fill((0, 0, 0, 0))
+        else:
+            surface = pygame.Surface(size).convert()
+            surface.fill(bgcolor)
+
+        atlas = self.getAtlas(fgcolor)
+        glyphs = atlas.get_width() // self.charW
+
+        for i, char in enumerate(text):
+            index = ord(char) - FIRST_CHAR
+            if 0 < index < glyphs:
+                surface.blit(atlas, (i * self.charW, 0), (index * self.charW, 0, self.charW, self.charH))
+
+        return surface
+
+    def getLine(self, text, fgcolor, bgcolor=None):
+        return self.lines.get((text, fgcolor, bgcolor, self.zoom),
+                              lambda: self.renderLine(text, fgcolor, bgcolor))
+
+    def print(self, output, text, x, y, fgcolor, bgcolor=None):
+        if not text:
+            return
+
+        output.blit(self.getLine(text, fgcolor, bgcolor), (math.floor(x * self.charW), math.floor(y * self.charH)))
+
+    def center(self, output, text, y, fgcolor, bgcolor=None):
+        if not text:
+            return
+
+        line = self.getLine(text, fgcolor, bgcolor)
+        output.blit(line, ((output.get_width() - line.get_width()) // 2, math.floor(y * self.charH)))
+
+    def stats(self):
+        return {'atlases': len(self.atlases),
+                'lines': len(self.lines.entries),
+                'hits': self.lines.hits,
+                'misses': self.lines.misses,
+                }
@@ -0,0 +1,181 @@
+import collections
+import itertools
+import selectors
+import threading
+import traceback
+import heapq
+import queue
+import time
+import os
+
+from wurolib import print
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class IOLoop:
+    """runs the i/o of the application in a single thread, multiplexing
+    readable files, timers and the exits of child processes.
+
+    the methods registering handlers may be called from any thread, the
+    handlers themselves are always called from the loop thread"""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+
+        self.timers = []
+        self.timerSeq = itertools.count()
+        self.calls = collections.deque()
+
+        self.wakeRead, self.wakeWrite = os.pipe()
+        os.set_blocking(self.wakeRead, False)
+        os.set_blocking(self.wakeWrite, False)
+        self.selector.register(self.wakeRead, selectors.EVENT_READ, None)
+
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name='ioloop', daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        self.running = False
+        self.wake()
+
+        if self.thread.is_alive() and threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
+
+    def wake(self):
+        try:
+            os.write(self.wakeWrite, b'\0')
+        except OSError:
+            pass    # loop is already being woken up, or has been stopped
+
+    def inLoop(self):
+        return threading.current_thread() is self.thread
+
+    def callSoon(self, callback, *args):
+        self.calls.append((callback, args))
+        self.wake()
+
+    def callLater(self, delay, callback, *args):
+        timer = Timer(time.monotonic() + delay, callback, args)
+
+        if self.inLoop():
+            self._addTimer(timer)
+        else:
+            self.callSoon(self._addTimer, timer)
+
+        return timer
+
+    def addReader(self, fileobj, callback, *args):
+        if self.inLoop():
+            self.selector.register(fileobj, selectors.EVENT_READ, (callback, args))
+        else:
+            self.callSoon(self.addReader, fileobj, callback, *args)
+
+    def removeReader(self, fileobj):
+        if self.inLoop():
+            try:
+                self.selector.unregister(fileobj)
+            except (KeyError, ValueError):
+                pass
+        else:
+            self.callSoon(self.removeReader, fileobj)
+
+    def watchSentinel(self, sentinel, callback, *args):
+        """calls callback once the fd of a multiprocessing sentinel is ready"""
+        def exited():
+            self.removeReader(sentinel)
+            callback(*args)
+
+        self.addReader(sentinel, exited)
+
+    def _addTimer(self, timer):
+        heapq.heappush(self.timers, (timer.deadline, next(self.timerSeq), timer))
+
+    def _call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            print(traceback.format_exc())
+
+    def _run(self):
+        while self.running:
+            if self.calls:
+                timeout = 0
+            elif self.timers:
+                timeout = max(0, self.timers[0][0] - time.monotonic())
+            else:
+                timeout = None
+
+            for key, mask in self.selector.select(timeout):
+                if key.data is None:
+                    try:
+                        os.read(self.wakeRead, 4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+
+                callback, args = key.data
+                self._call(callback, args)
+
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                _deadline, _seq, timer = heapq.heappop(self.timers)
+                if not timer.cancelled:
+                    self._call(timer.callback, timer.args)
+
+            for i in range(len(self.calls)):
+                callback, args = self.calls.popleft()
+                self._call(callback, args)
+
+        self.selector.close()
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+
+class Worker:
+    """runs blocking calls, like file i/o, one after the other in a thread of
+    its own, to keep them from delaying the io loop's timers; submit() may
+    be called from any thread"""
+
+    def __init__(self, name='worker'):
+        self.calls = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        self.calls.put(None)
+
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def submit(self, func, *args):
+        self.calls.put((func, args))
+
+    def _run(self):
+        while True:
+            call = self.calls.get()
+            if call is None:
+                break
+
+            func, args = call
+            try:
+                func(*args)
+            except Exception:
+                print(traceback.format_exc())
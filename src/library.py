@@ -0,0 +1,223 @@
+import collections
+import collections.abc
+import threading
+import os
+
+from pages import PageIndex, compileBlock
+
+
+# a page library is a directory holding one file per song, e.g. WINT.txt,
+# containing the lines of one page like a PAGE: block of pages.txt, and
+# an optional setlist file with one page name per line defining the order
+
+SETLIST_NAME = 'setlist.txt'
+PAGE_SUFFIX = '.txt'
+
+
+def readSetlist(path):
+    try:
+        with open(path, 'r') as f:
+            lines = [line.strip() for line in f]
+    except FileNotFoundError:
+        return []
+
+    return [line for line in lines if line and not line.startswith('#')]
+
+
+class PageLibrary:
+    """pages of a library directory, loaded on demand.
+
+    only the directory listing and the setlist are read up front; pages are
+    compiled when they are first requested and kept in an LRU of at most
+    maxResident pages. onLoad(name, cmds, errors) is called whenever a page
+    was compiled, in the thread which requested it.
+
+    may be used from the main thread and the ioloop.Worker thread, which
+    runs the prefetches and refreshes"""
+
+    def __init__(self, directory, colors, maxResident=32, onLoad=None):
+        self.directory = directory
+        self.colors = colors
+        self.maxResident = maxResident
+        self.onLoad = onLoad
+
+        self.lock = threading.RLock()
+        self.files = {}         # page name -> (path, mtime, size)
+        self.resident = collections.OrderedDict()   # page name -> (stat, page, cmds)
+        self.index = PageIndex([])
+
+        self.pages = LibraryPages(self)
+        self.pageCmds = LibraryCommands(self)
+
+        self.hits = 0
+        self.misses = 0
+
+    def scan(self):
+        files = {}
+
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(PAGE_SUFFIX) or entry.name == SETLIST_NAME:
+                    continue
+
+                if not entry.is_file():
+                    continue
+
+                st = entry.stat()
+                name = entry.name[:-len(PAGE_SUFFIX)]
+                files[name] = (entry.path, st.st_mtime_ns, st.st_size)
+
+        return files
+
+    def refresh(self):
+        """re-reads the directory listing and the setlist; returns the names
+        of the pages that changed, the names of the removed pages and errors
+        found in the setlist"""
+
+        files = self.scan()
+        setlist = readSetlist(os.path.join(self.directory, SETLIST_NAME))
+        errors = []
+
+        names = []
+        listed = set()
+        for name in setlist:
+            if not name in files:
+                errors.append('%s: page %s not found' % (SETLIST_NAME, name))
+            elif not name in listed:
+                names.append(name)
+                listed.add(name)
+
+        # pages missing from the setlist can still be jumped to
+        names += sorted(name for name in files if not name in listed)
+
+        with self.lock:
+            changed = [name for name in files if name in self.files and files[name] != self.files[name]]
+            changed += [name for name in files if not name in self.files]
+            removed = [name for name in self.files if not name in files]
+
+            for name in changed + removed:
+                self.resident.pop(name, None)
+
+            self.files = files
+            self.index = PageIndex(names)
+
+        return changed, removed, errors
+
+    def load(self, name):
+        """returns (page, cmds) of the page, compiling it if it is not resident;
+        raises KeyError for unknown pages"""
+
+        with self.lock:
+            try:
+                stat, page, cmds = self.resident[name]
+            except KeyError:
+                pass
+            else:
+                self.hits += 1
+                self.resident.move_to_end(name)
+                return page, cmds
+
+            stat = self.files[name]
+
+        # reading the file may take a while, so it is done without the lock
+        path = stat[0]
+        try:
+            with open(path, 'r') as f:
+                lines = f.readlines()
+        except OSError as e:
+            lines = []
+            errors = ['could not read %s: %s' % (path, e)]
+        else:
+            errors = []
+
+        page, cmds, blockErrors = compileBlock(name, 1, lines, self.colors)
+        errors = ['%s: %s' % (name, error) for error in errors + blockErrors]
+
+        with self.lock:
+            if name in self.resident:
+                # compiled by another thread meanwhile
+                self.hits += 1
+                stat, page, cmds = self.resident[name]
+                return page, cmds
+
+            self.misses += 1
+            self.resident[name] = (stat, page, cmds)
+
+            while len(self.resident) > self.maxResident:
+                self.resident.popitem(last=False)
+
+            # called with the lock held, so a page cannot be loaded between
+            # a caller checking its state and iterating residentCommands()
+            if self.onLoad:
+                self.onLoad(name, cmds, errors)
+
+        return page, cmds
+
+    def prefetch(self, name):
+        """loads the page following the given one in setlist order"""
+        with self.lock:
+            nextName = self.index.next(name) if name in self.index else None
+
+        if nextName is not None:
+            self.load(nextName)
+
+    def residentCommands(self):
+        with self.lock:
+            return {name: cmds for name, (stat, page, cmds) in self.resident.items() if cmds}
+
+    def stats(self):
+        with self.lock:
+            return {'pages': len(self.index),
+                    'resident': len(self.resident),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    }
+
+
+class LibraryPages(collections.abc.Mapping):
+    """read-only dict of the pages of a PageLibrary, loading them on access"""
+
+    def __init__(self, library):
+        self.library = library
+
+    def __getitem__(self, name):
+        return self.library.load(name)[0]
+
+    def __contains__(self, name):
+        return name in self.library.index
+
+    def __iter__(self):
+        return iter(self.library.index)
+
+    def __len__(self):
+        return len(self.library.index)
+
+
+class LibraryCommands(collections.abc.Mapping):
+    """read-only dict of the commands of the pages of a PageLibrary which
+    have any; checking for a page's commands loads the page"""
+
+    def __init__(self, library):
+        self.library = library
+
+    def __getitem__(self, name):
+        cmds = self.library.load(name)[1]
+        if not cmds:
+            raise KeyError(name)
+
+        return cmds
+
+    def __contains__(self, name):
+        try:
+            self[name]
+        except KeyError:
+            return False
+
+        return True
+
+    def __iter__(self):
+        # only resident pages, iterating must not load the whole library
+        return iter(self.library.residentCommands())
+
+    def __len__(self):
+        return len(self.library.residentCommands())
@@ -0,0 +1,88 @@
+import array
+import math
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+METER_RANGE = 60    # dB shown on the meter, anything below is silence
+PEAK_HOLD = 1.5     # seconds a peak is held before it falls back
+
+
+def toDb(level):
+    if level <= 0:
+        return -math.inf
+
+    return 20 * math.log10(level)
+
+def toPercent(db):
+    return min(max((db + METER_RANGE) * 100 / METER_RANGE, 0), 100)
+
+
+class Meter:
+    """measures rms and peak levels per channel of interleaved signed 16 bit
+    little endian pcm data, in blocks of 1/updateRate seconds"""
+
+    def __init__(self, channels=2, rate=44100, updateRate=20):
+        self.channels = channels
+        self.blockSize = rate // updateRate * channels * 2
+
+        self.pending = bytearray()
+
+        self.rms = [-math.inf] * channels
+        self.peak = [-math.inf] * channels
+        self.peakHold = [-math.inf] * channels
+        self.peakTime = [0] * channels
+
+    def reset(self):
+        self.pending.clear()
+
+        for c in range(self.channels):
+            self.rms[c] = self.peak[c] = self.peakHold[c] = -math.inf
+
+    def process(self, data):
+        """feeds pcm data; returns True if a new measurement is available"""
+        self.pending += data
+
+        measured = False
+        while len(self.pending) >= self.blockSize:
+            self.measure(self.pending[:self.blockSize])
+            del self.pending[:self.blockSize]
+            measured = True
+
+        return measured
+
+    def measure(self, block):
+        if numpy is not None:
+            samples = numpy.frombuffer(block, dtype='<i2').reshape(-1, self.channels) / 32768
+            rms = numpy.sqrt(numpy.mean(samples * samples, axis=0)).tolist()
+            peak = numpy.max(numpy.abs(samples), axis=0).tolist()
+        else:
+            samples = array.array('h', bytes(block))
+            if sys.byteorder == 'big':
+                samples.byteswap()
+
+            rms = []
+            peak = []
+            for c in range(self.channels):
+                channel = samples[c::self.channels]
+                rms.append(math.sqrt(sum(x * x for x in channel) / len(channel)) / 32768)
+                peak.append(max(max(channel), -min(channel)) / 32768)
+
+        now = time.monotonic()
+
+        for c in range(self.channels):
+            self.rms[c] = toDb(rms[c])
+            self.peak[c] = toDb(peak[c])
+
+            if self.peak[c] >= self.peakHold[c] or now - self.peakTime[c] > PEAK_HOLD:
+                self.peakHold[c] = self.peak[c]
+                self.peakTime[c] = now
+
+    def getLevels(self):
+        """returns rms and held peak levels per channel in dBFS"""
+        return list(self.rms), list(self.peakHold)
@@ -0,0 +1,240 @@
+import bisect
+import socket
+import json
+import time
+
+from wurolib import print
+
+
+# bucket upper bounds for durations in ms
+TIME_BUCKETS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# bucket upper bounds for sizes and counts
+SIZE_BUCKETS = (0, 1, 2, 4, 8, 16, 64, 256, 1024, 4096, 16384, 65536)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def reset(self):
+        self.value = 0
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Histogram:
+    """counts values in fixed buckets; the percentiles are reported as the
+    upper bound of the bucket they fall into"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) +1)     # the last one counts overflows
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(0.5),
+                'p95': self.percentile(0.95),
+                'max': self.max,
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['inf'], self.counts)),
+                }
+
+
+class Gauge:
+    """a value read from func when a snapshot is taken"""
+
+    __slots__ = ('func',)
+
+    def __init__(self, func):
+        self.func = func
+
+    def reset(self):
+        pass
+
+    def snapshot(self):
+        try:
+            return {'value': self.func()}
+        except Exception:
+            return {'value': None}
+
+
+class Registry:
+    """named counters, histograms and gauges.
+
+    updates are not locked: the metrics are written from several threads,
+    and an increment lost to a race now and then is cheaper than a lock on
+    every frame and midi message"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []    # called before the metrics are read
+        self.started = time.time()
+
+    def get(self, name, create):
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics.setdefault(name, create())
+
+        return metric
+
+    def counter(self, name):
+        return self.get(name, Counter)
+
+    def histogram(self, name, buckets=TIME_BUCKETS):
+        return self.get(name, lambda: Histogram(buckets))
+
+    def gauge(self, name, func):
+        self.metrics[name] = Gauge(func)
+
+    def add(self, name, metric):
+        self.metrics[name] = metric
+
+    def addCollector(self, func):
+        """func is called to update metrics maintained elsewhere before
+        they are read"""
+        self.collectors.append(func)
+
+    def collect(self):
+        for func in self.collectors:
+            try:
+                func()
+            except Exception as e:
+                print('could not collect metrics:', e)
+
+    def reset(self):
+        # in place, the metrics are kept by the code updating them
+        for metric in list(self.metrics.values()):
+            metric.reset()
+
+        self.started = time.time()
+
+    def snapshot(self):
+        self.collect()
+
+        return {'time': time.time(),
+                'since': self.started,
+                'metrics': {name: metric.snapshot() for name, metric in sorted(self.metrics.items())},
+                }
+
+    def format(self, prefix=''):
+        """returns short lines describing the metrics, for the console"""
+        self.collect()
+
+        lines = []
+        seconds = max(time.time() - self.started, 1e-3)
+
+        for name, metric in sorted(self.metrics.items()):
+            if not name.startswith(prefix):
+                continue
+
+            if isinstance(metric, Histogram):
+                if not metric.count:
+                    continue
+
+                lines.append(name)
+                lines.append('  %i avg %.1f p95 %s max %.1f' % (metric.count, metric.total / metric.count,
+                                                                metric.percentile(0.95), metric.max))
+
+            elif isinstance(metric, Counter):
+                lines.append('%s %i (%.1f/s)' % (name, metric.value, metric.value / seconds))
+
+            else:
+                lines.append('%s %s' % (name, metric.snapshot()['value']))
+
+        return lines
+
+
+# the registry of the application
+registry = Registry()
+
+
+class Exporter:
+    """writes a snapshot of a registry every interval seconds, from the
+    ioloop.IOLoop thread; target is 'file:PATH' for one json object per
+    line, or 'udp:HOST:PORT' for one json datagram per snapshot"""
+
+    def __init__(self, loop, registry, target, interval=10):
+        self.loop = loop
+        self.registry = registry
+        self.interval = interval
+        self.timer = None
+
+        self.file = None
+        self.sock = None
+
+        kind, _sep, address = target.partition(':')
+
+        if kind == 'file':
+            self.file = open(address, 'a')
+        elif kind == 'udp':
+            host, _sep, port = address.rpartition(':')
+            self.address = (host, int(port))
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setblocking(False)
+        else:
+            raise ValueError('invalid metrics target "%s"' % target)
+
+    def start(self):
+        self.timer = self.loop.callLater(self.interval, self._export)
+
+    def stop(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        if self.file:
+            self.loop.callSoon(self.file.close)
+
+        if self.sock:
+            self.loop.callSoon(self.sock.close)
+
+    def _export(self):
+        data = json.dumps(self.registry.snapshot())
+
+        try:
+            if self.file:
+                self.file.write(data + '\n')
+                self.file.flush()
+            else:
+                self.sock.sendto(data.encode(), self.address)
+        except OSError as e:
+            print('could not export metrics:', e)
+
+        self.timer = self.loop.callLater(self.interval, self._export)
@@ -4,100 +4,338 @@ import time
 
 from wurolib import print
 
+from scheduler import BeatClock
 
-class MidiThread:
-    def __init__(self, pageCallback=lambda:None, syncCallback=lambda:None):
+import metrics
+
+
+# input polling: after a message arrives the input is polled again after
+# MIN_POLL_INTERVAL, backing off exponentially up to the configured latency
+# (portmidi offers no file descriptor that could be waited on)
+
+MIN_POLL_INTERVAL = 0.0002
+DEFAULT_LATENCY = 0.002
+
+# page changes arriving within this many seconds of each other are treated
+# as one burst: the first page is selected right away, of the others only
+# the last one once the burst is over
+DEFAULT_COALESCE = 0.01
+
+# portmidi device ids of the interface's ports
+INPUT_DEVICE = 3
+OUTPUT_DEVICE = 2
+
+# usb midi interfaces may show up after the prompter has started
+DEVICE_RETRY = 0.3
+
+# sysex page names: 0 is a space, 1-9 are digits, everything else is ascii
+SYSEX_TABLE = bytes([ord(' ')] + [ord('0') + b for b in range(1, 10)] + list(range(10, 256)))
+
+
+class SysexDecoder:
+    """reassembles sysex messages from the 4 byte packets delivered by
+    pygame.midi, even if a message is split across several reads"""
+
+    def __init__(self, callback=lambda text:None):
+        self.callback = callback
+        self.buffer = None
+
+    def feed(self, packet):
+        """returns True if the packet was consumed as part of a sysex message"""
+        status = packet[0]
+
+        if status >= 0xF8:
+            # real-time messages may arrive in the middle of a sysex message
+            # as events of their own and do not belong to it
+            return False
+        elif status == 0xF0:
+            self.buffer = bytearray()
+            data = packet[1:]
+        elif self.buffer is None:
+            return False
+        elif 0x80 <= status < 0xF8 and status != 0xF7:
+            # any other status byte aborts a running sysex message
+            self.buffer = None
+            return False
+        else:
+            data = packet
+
+        data = bytes(data)
+        end = data.find(0xF7)
+
+        if end < 0:
+            self.buffer += data
+        else:
+            self.buffer += data[:end]
+            text = self.buffer.translate(SYSEX_TABLE).decode('latin-1')
+            self.buffer = None
+            self.callback(text)
+
+        return True
+
+
+def waitForDevices(timeout, interval=DEVICE_RETRY):
+    """waits until the input and output ports used by MidiThread exist;
+    returns False if they did not show up within timeout seconds. portmidi
+    only looks for devices when it is initialized, so it is reinitialized
+    for every try"""
+
+    deadline = time.monotonic() + timeout
+
+    while True:
         pygame.midi.init()
-        
-        try:
-            self.midi_in = pygame.midi.Input(3) 
-        except:
-            self.midi_in = None
 
-        try:
-            self.midi_out = pygame.midi.Output(2)
-        except:
-            self.midi_out = None
+        count = pygame.midi.get_count()
+        if count > max(INPUT_DEVICE, OUTPUT_DEVICE) and \
+           pygame.midi.get_device_info(INPUT_DEVICE)[2] and \
+           pygame.midi.get_device_info(OUTPUT_DEVICE)[3]:
+            return True
+
+        if time.monotonic() >= deadline:
+            return False
+
+        pygame.midi.quit()
+        time.sleep(interval)
+
+
+class MidiThread:
+    """midi input and output; the input is polled by timers on the given
+    ioloop.IOLoop, from which thread the callbacks are called as well"""
+
+    def __init__(self, loop, pageCallback=lambda:None, syncCallback=lambda:None, latency=DEFAULT_LATENCY, coalesce=DEFAULT_COALESCE, devices=None):
+        if devices is not None:
+            # stand-ins with the interface of pygame.midi.Input and Output
+            self.midi_in, self.midi_out = devices
+            self.deviceTime = None
+        else:
+            self.deviceTime = pygame.midi.time
+            pygame.midi.init()
+
+            try:
+                self.midi_in = pygame.midi.Input(INPUT_DEVICE)
+            except:
+                self.midi_in = None
+
+            try:
+                self.midi_out = pygame.midi.Output(OUTPUT_DEVICE)
+            except:
+                self.midi_out = None
 
+        self.loop = loop
         self.running = False
-        self.thread = threading.Thread(target=self._run)
+        self.pollTimer = None
+        self.pollInterval = MIN_POLL_INTERVAL
 
         self.pageCallback = pageCallback
         self.syncCallback = syncCallback
 
+        # upper bound for the delay between arrival and processing of a
+        # message; lower values mean faster reaction but more cpu usage
+        self.latency = max(latency, MIN_POLL_INTERVAL)
+
+        self.coalesce = coalesce
+        self.pendingPage = None
+        self.pendingDeadline = 0
+        self.pendingArrival = None
+        self.burstEnd = 0
+        self.arrival = None     # time.monotonic() at which the message being read arrived
+
+        self.sysex = SysexDecoder(callback=self._pageReceived)
+
+        self.recorder = None    # midicapture.MidiRecorder of the input
+
+        self.clock = BeatClock()
+
+        # mixer channel states, bit n-1 stands for channel n
+        self.muteMask = 0       # channels muted
+        self.knownMask = 0      # channels whose state is known
+
+        # guards the output and the channel states; the output is used from
+        # the main, io loop and scheduler threads, portmidi is not thread-safe
+        self.outLock = threading.Lock()
+
+        self.messageCount = metrics.registry.counter('midi.in')
+        self.pageLatency = metrics.registry.histogram('midi.in.page')
+        self.syncLatency = metrics.registry.histogram('midi.in.sync')
+        self.sendTime = metrics.registry.histogram('midi.out.send')
+
     def start(self):
         self.running = True
-        self.thread.start()
+
+        if self.midi_in:
+            self.pollTimer = self.loop.callLater(0, self._poll)
             
     def stop(self):
         self.running = False
 
-    def _run(self):
-        def convert(bytes):
-            s = ''
-            for b in bytes:
-                if b == 0:
-                    s += ' '
-                elif b < 10:
-                    s += str(b)
-                elif b == 0xF7: # end of message
-                    break
-                else:
-                    s += chr(b)
-            return s
-
-        while self.running:
-            if self.midi_in:
-                while not self.midi_in.poll():
-                    time.sleep(0.1)
-
-                data = self.midi_in.read(256)
-
-                if data:
-                    next = False
-                    for msg in data:
-                        cmd = msg[0]
-                        timestamp = msg[1]
-
-                        if cmd[0] == 0xF0:  # sysex
-                            pagename = convert(cmd[1:])
-                            next = True
-                        elif next:
-                            pagename += convert(cmd)
-                            if 0xF7 in cmd:
-                                next = False
-                                self.pageCallback(pagename)
-                        elif cmd[0] == 0x9F: # note on, channel 16
-                            self.syncCallback()
+        if self.pollTimer:
+            self.pollTimer.cancel()
+
+        if self.recorder:
+            self.stopCapture()
+
+    def startCapture(self, recorder):
+        """has the input written to the given midicapture.MidiRecorder"""
+        self.loop.callSoon(self._setRecorder, recorder)
 
+    def stopCapture(self):
+        self.loop.callSoon(self._setRecorder, None)
+
+    def _setRecorder(self, recorder):
+        if self.recorder:
+            print('captured %i midi messages' % self.recorder.count)
+            self.recorder.close()
+
+        self.recorder = recorder
+
+    def _pageReceived(self, pagename):
+        now = time.monotonic()
+
+        self.pendingPage = pagename
+        self.pendingArrival = self.arrival
+
+        if now >= self.burstEnd:
+            self._flushPage()
+        else:
+            self.pendingDeadline = now + self.coalesce
+
+        self.burstEnd = now + self.coalesce
+
+    def _flushPage(self):
+        if self.pendingPage is not None:
+            pagename = self.pendingPage
+            self.pendingPage = None
+            self.pageCallback(pagename)
+
+            # includes the coalescing delay of the later pages of a burst
+            self.pageLatency.observe((time.monotonic() - self.pendingArrival) * 1000)
+
+    def _poll(self):
+        if not self.running:
+            return
+
+        if self.midi_in.poll():
+            self._read()
+            self.pollInterval = MIN_POLL_INTERVAL
+        else:
+            self.pollInterval = min(self.pollInterval * 2, self.latency)
+
+        delay = self.pollInterval
+
+        if self.pendingPage is not None:
+            remaining = self.pendingDeadline - time.monotonic()
+
+            if remaining <= 0 and not self.midi_in.poll():
+                # burst is over, select the last page received
+                self._flushPage()
             else:
-                time.sleep(0.1)
+                delay = min(delay, max(remaining, 0))
+
+        self.pollTimer = self.loop.callLater(delay, self._poll)
+
+    def _read(self):
+        now = time.monotonic()
+
+        # portmidi timestamps the messages on arrival in ms of its own clock
+        if self.deviceTime:
+            offset = now - self.deviceTime() / 1000
+        else:
+            offset = None
+
+        messages = self.midi_in.read(256)
+        self.messageCount.inc(len(messages))
+
+        for msg in messages:
+            cmd = msg[0]
+            timestamp = msg[1]
+
+            self.arrival = timestamp / 1000 + offset if offset is not None else now
+
+            if self.recorder:
+                self.recorder.record(msg)
+
+            if self.sysex.feed(cmd):
+                continue
+
+            if cmd[0] == 0xF8:
+                self.clock.clock(self.arrival)
+                continue
+
+            elif cmd[0] == 0xFA:
+                self.clock.start()
+            elif cmd[0] == 0xFB:
+                self.clock.resume()
+            elif cmd[0] == 0xFC:
+                self.clock.stop()
+            elif cmd[0] == 0xF2:
+                self.clock.songPosition(cmd[1] | cmd[2] << 7)
+
+            if cmd[0] == 0x9F: # note on, channel 16
+                # a pending page change has to be handled before the sync
+                self._flushPage()
+                self.syncCallback()
+
+                self.syncLatency.observe((time.monotonic() - self.arrival) * 1000)
     
     def sendMute(self, channel):
-        if self.midi_out is None:
-            return False
-            
-        self.midi_out.note_on(38 + (channel -1), 0x7F, 15)
-        return True
+        return self.applyMutes(1 << (channel -1), 0)
     
     def sendUnmute(self, channel):
+        return self.applyMutes(0, 1 << (channel -1))
+
+    def applyMutes(self, mutes, unmutes):
+        """brings the given channels into the given state; only messages for
+        channels whose state differs from the last one sent (or is not known
+        yet) are sent, unmutes first"""
+
         if self.midi_out is None:
             return False
-            
-        self.midi_out.note_off(38 + (channel -1), 0x7F, 15)
+
+        start = time.perf_counter()
+
+        with self.outLock:
+            unknown = ~self.knownMask
+            unmutes &= self.muteMask | unknown
+            mutes &= ~self.muteMask | unknown
+
+            for channel in range(16):
+                if unmutes & (1 << channel):
+                    self.midi_out.note_off(38 + channel, 0x7F, 15)
+
+            for channel in range(16):
+                if mutes & (1 << channel):
+                    self.midi_out.note_on(38 + channel, 0x7F, 15)
+
+            self.muteMask = (self.muteMask | mutes) & ~unmutes
+            self.knownMask |= mutes | unmutes
+
+        self.sendTime.observe((time.perf_counter() - start) * 1000)
+
         return True
         
     def sendNextSequence(self):
         if self.midi_out is None:
             return False
             
-        self.midi_out.note_on(37, 0x7F, 15)
+        start = time.perf_counter()
+
+        with self.outLock:
+            self.midi_out.note_on(37, 0x7F, 15)
+
+        self.sendTime.observe((time.perf_counter() - start) * 1000)
+
         return True
     
     def sendPrevSequence(self):
         if self.midi_out is None:
             return False
             
-        self.midi_out.note_on(36, 0x7F, 15)
+        start = time.perf_counter()
+
+        with self.outLock:
+            self.midi_out.note_on(36, 0x7F, 15)
+
+        self.sendTime.observe((time.perf_counter() - start) * 1000)
+
         return True
     
@@ -0,0 +1,113 @@
+import threading
+import time
+
+
+# captured midi input is stored as text, one message per line:
+#   arrival timestamp status data1 data2 data3
+# with the arrival in seconds since the start of the capture, as seen by
+# MidiThread, and the timestamp in ms as delivered by portmidi (msg[1])
+
+HEADER = '# prompter midi capture 1\n'
+
+
+class MidiRecorder:
+    """writes the messages read by MidiThread to a capture file"""
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.file.write(HEADER)
+        self.start = time.monotonic()
+        self.count = 0
+
+    def record(self, msg):
+        data, timestamp = msg
+        self.file.write('%.6f %i %i %i %i %i\n' % ((time.monotonic() - self.start, timestamp) + tuple(data[:4])))
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def loadCapture(path):
+    """returns the messages of a capture file as (arrival, timestamp, data)"""
+    messages = []
+
+    with open(path, 'r') as f:
+        for i, line in enumerate(f, 1):
+            if line.startswith('#') or not line.strip():
+                continue
+
+            try:
+                arrival, timestamp, *data = line.split()
+                messages.append((float(arrival), int(timestamp), [int(b) for b in data]))
+            except ValueError:
+                raise ValueError('line %i: invalid message' % i)
+
+    return messages
+
+
+class ReplayInput:
+    """pygame.midi.Input stand-in replaying captured messages in real time,
+    or faster by the given factor; messages become readable at their
+    original distance from the first message, taken from the portmidi
+    timestamps, or from the arrival times with useArrival=True.
+
+    due holds the time.monotonic() at which each message became readable"""
+
+    def __init__(self, messages, speed=1, useArrival=False):
+        self.messages = messages
+        self.speed = speed
+
+        if messages:
+            first = messages[0][0] if useArrival else messages[0][1] / 1000
+        else:
+            first = 0
+
+        self.offsets = [((arrival if useArrival else timestamp / 1000) - first) / speed
+                        for arrival, timestamp, data in messages]
+
+        self.start = None
+        self.next = 0
+        self.due = [None] * len(messages)
+
+    def begin(self):
+        self.start = time.monotonic()
+
+    def isFinished(self):
+        return self.next >= len(self.messages)
+
+    def getDuration(self):
+        return self.offsets[-1] if self.offsets else 0
+
+    def poll(self):
+        return self.start is not None and not self.isFinished() and \
+               time.monotonic() - self.start >= self.offsets[self.next]
+
+    def read(self, count):
+        now = time.monotonic() - self.start
+        result = []
+
+        while self.next < len(self.messages) and len(result) < count and self.offsets[self.next] <= now:
+            arrival, timestamp, data = self.messages[self.next]
+            self.due[self.next] = self.start + self.offsets[self.next]
+            result.append([list(data), timestamp])
+            self.next += 1
+
+        return result
+
+
+class CapturingOutput:
+    """pygame.midi.Output stand-in keeping the messages sent, with the
+    time.monotonic() at which they were sent"""
+
+    def __init__(self):
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def note_on(self, note, velocity, channel=0):
+        with self.lock:
+            self.sent.append((time.monotonic(), 0x90 | channel, note, velocity))
+
+    def note_off(self, note, velocity=0, channel=0):
+        with self.lock:
+            self.sent.append((time.monotonic(), 0x80 | channel, note, velocity))
@@ -0,0 +1,201 @@
+import hashlib
+import marshal
+import struct
+import mmap
+import io
+import os
+
+from wurolib import print
+
+import pages
+from pages import Page, PageLine, CommandProgram
+
+
+# compiled pages are cached in a file starting with a header identifying
+# the source file it was compiled from and how, followed by the marshalled
+# blocks. the compiler is identified by a hash of the source of pages.py
+# and this module, so any change to them invalidates the cache; colors are
+# stored resolved, so the cache depends on the color table as well
+
+MAGIC = b'PRMC'
+VERSION = 5     # layout of the header
+
+HEADER = struct.Struct('<4sH8s8sQq20s')     # magic, version, compiler hash, colors hash, size, mtime, sha1
+
+CACHE_NAME = '.pages.cache'
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'prompter')
+
+
+def getCachePaths(sourcePath):
+    """the cache is stored next to the source file, or in the local cache
+    directory if the source is on a read-only medium"""
+    sourcePath = os.path.abspath(sourcePath)
+    key = hashlib.sha1(os.fsencode(sourcePath)).hexdigest()[:16]
+
+    return [os.path.join(os.path.dirname(sourcePath), CACHE_NAME),
+            os.path.join(CACHE_DIR, 'pages-%s.cache' % key),
+            ]
+
+
+def hashCompiler():
+    digest = hashlib.sha1()
+
+    for path in (pages.__file__, __file__):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.digest()[:8]
+
+
+COMPILER = hashCompiler()
+
+
+def hashColors(colors):
+    return hashlib.sha1(repr([tuple(color) for color in colors]).encode()).digest()[:8]
+
+
+def dumpBlocks(pageFile):
+    blocks = []
+
+    for name, (source, page, cmds, errors) in pageFile.blocks.items():
+        lines = tuple((line.kind, line.text, line.fgcolor, line.bgcolor) for line in page.lines)
+        programs = {key: (program.source, program.ops) for key, program in cmds.items()}
+
+        blocks.append((name, source, lines, programs, tuple(errors)))
+
+    return marshal.dumps(blocks)
+
+
+def restoreBlocks(pageFile, data):
+    """fills pageFile from the cached blocks; returns all errors found when
+    the blocks were compiled"""
+
+    blocks = marshal.loads(data)
+    allErrors = []
+
+    pageFile.blocks = {}
+    pageFile.pages = {}
+    pageFile.pageCmds = {}
+
+    for name, source, lines, programs, errors in blocks:
+        page = Page(name)
+        for kind, text, fgcolor, bgcolor in lines:
+            page.addLine(PageLine(kind, text, fgcolor, bgcolor))
+
+        cmds = {key: CommandProgram(cmdSource, ops) for key, (cmdSource, ops) in programs.items()}
+
+        pageFile.blocks[name] = (source, page, cmds, list(errors))
+        pageFile.pages[name] = page
+        if cmds:
+            pageFile.pageCmds[name] = cmds
+
+        allErrors += errors
+
+    return allErrors
+
+
+def readHeader(mm, colorsHash):
+    if len(mm) < HEADER.size:
+        return None
+
+    magic, version, compiler, cachedColors, size, mtime, digest = HEADER.unpack_from(mm)
+    if magic != MAGIC or version != VERSION or compiler != COMPILER or cachedColors != colorsHash:
+        return None
+
+    return size, mtime, digest
+
+
+def writeCache(sourcePath, colorsHash, stat, digest, payload):
+    for path in getCachePaths(sourcePath):
+        tmp = path + '.tmp'
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            with open(tmp, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, COMPILER, colorsHash, stat.st_size, stat.st_mtime_ns, digest))
+                f.write(payload)
+
+            os.replace(tmp, path)
+            return path
+        except OSError:
+            continue
+
+    print('could not write page cache')
+    return None
+
+
+def load(pageFile, sourcePath):
+    """fills pageFile from a valid cache of sourcePath, or by compiling the
+    source and caching the result; returns the errors found in the source.
+
+    a cache matching the source's size and mtime is used without reading
+    the source at all; otherwise it is still used if the hash of the source
+    matches, e.g. after copying the file"""
+
+    stat = os.stat(sourcePath)
+    colorsHash = hashColors(pageFile.colors)
+    caches = []
+
+    for path in getCachePaths(sourcePath):
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            continue
+
+        header = readHeader(mm, colorsHash)
+        if header is None:
+            mm.close()
+            continue
+
+        size, mtime, digest = header
+        if size == stat.st_size and mtime == stat.st_mtime_ns:
+            try:
+                with memoryview(mm) as view, view[HEADER.size:] as data:
+                    return restoreBlocks(pageFile, data)
+            except (ValueError, EOFError, TypeError):
+                pass
+            finally:
+                mm.close()
+        else:
+            caches.append((mm, digest))
+
+    with open(sourcePath, 'rb') as f:
+        source = f.read()
+
+    digest = hashlib.sha1(source).digest()
+
+    try:
+        for mm, cachedDigest in caches:
+            if cachedDigest == digest:
+                try:
+                    with memoryview(mm) as view, view[HEADER.size:] as data:
+                        errors = restoreBlocks(pageFile, data)
+                        payload = bytes(data)
+                except (ValueError, EOFError, TypeError):
+                    continue
+
+                writeCache(sourcePath, colorsHash, stat, digest, payload)
+                return errors
+    finally:
+        for mm, cachedDigest in caches:
+            mm.close()
+
+    # the text is decoded the same way open(sourcePath, 'r') would
+    changed, removed, errors = pageFile.update(io.TextIOWrapper(io.BytesIO(source)))
+    writeCache(sourcePath, colorsHash, stat, digest, dumpBlocks(pageFile))
+
+    return errors
+
+
+def save(pageFile, sourcePath):
+    """caches the current state of pageFile, compiled from sourcePath"""
+    try:
+        stat = os.stat(sourcePath)
+        with open(sourcePath, 'rb') as f:
+            digest = hashlib.sha1(f.read()).digest()
+    except OSError:
+        return
+
+    writeCache(sourcePath, hashColors(pageFile.colors), stat, digest, dumpBlocks(pageFile))
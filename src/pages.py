@@ -0,0 +1,413 @@
+from wurolib import print
+
+
+# kinds of page lines
+
+LINE_STATIC = 0
+LINE_BLINK = 1
+LINE_MOUSEPOS = 2
+
+MOUSEPOS_ROWS = 4   # three coordinate lines plus one empty line
+
+
+class PageLine:
+    __slots__ = ('kind', 'text', 'fgcolor', 'bgcolor', 'row')
+
+    def __init__(self, kind, text, fgcolor, bgcolor=None, row=0):
+        self.kind = kind
+        self.text = text
+        self.fgcolor = fgcolor
+        self.bgcolor = bgcolor
+        self.row = row
+
+    def isDynamic(self):
+        return self.kind != LINE_STATIC
+
+
+class Page:
+    __slots__ = ('name', 'lines', 'dynamic', 'blinking', 'rows')
+
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+        self.dynamic = False
+        self.blinking = False
+        self.rows = 0
+
+    def addLine(self, line):
+        line.row = self.rows
+        self.lines.append(line)
+
+        if line.kind == LINE_MOUSEPOS:
+            self.rows += MOUSEPOS_ROWS
+        else:
+            self.rows += 1
+
+        if line.isDynamic():
+            self.dynamic = True
+
+        if line.kind == LINE_BLINK:
+            self.blinking = True
+
+
+# steps of compiled page commands
+
+STEP_SEND = 0       # send a batch of (func, args) midi operations
+STEP_CALL = 1       # call func(), report an error if it returns False
+
+CHANNELS = range(1, 17)
+
+WAIT_UNITS = ('beat', 'bar')    # wait=beat, wait=bar, wait=4bars...
+
+
+class CommandProgram:
+    """a CMD: line compiled into a sequence of operations; bind() resolves
+    them to the functions called by MainScreen.runCommand"""
+
+    __slots__ = ('source', 'ops', 'steps', 'queued', 'wait', 'quantize')
+
+    def __init__(self, source, ops):
+        self.source = source
+        self.ops = ops
+
+        self.steps = ()
+        self.queued = ()
+        self.wait = False
+        self.quantize = None    # (unit, count) of a wait for the midi clock
+
+    def bind(self, midi, console):
+        """splits the operations into steps executed immediately and a batch
+        of midi operations that is queued if the program contains a wait;
+        all batches before the last wait are sent immediately.
+
+        after a wait for the midi clock, next and prev are queued as well,
+        so they happen on the beat together with the mutes"""
+
+        def batch():
+            # mutes and unmutes are merged into the resulting channel state,
+            # later operations on a channel override earlier ones
+            if mutes or unmutes:
+                return ((midi.applyMutes, (mutes, unmutes)),) + tuple(calls)
+            return tuple(calls)
+
+        steps = []
+        calls = []
+        mutes = unmutes = 0
+        wait = False
+        quantize = None
+
+        for verb, arg in self.ops:
+            if verb == 'mute':
+                mutes |= 1 << (arg -1)
+                unmutes &= ~(1 << (arg -1))
+
+            elif verb == 'unmute':
+                unmutes |= 1 << (arg -1)
+                mutes &= ~(1 << (arg -1))
+
+            elif verb == 'wait':
+                wait = True
+                quantize = arg
+                steps.append((STEP_SEND, batch()))
+                mutes = unmutes = 0
+                calls = []
+
+            elif verb in ('next', 'prev'):
+                func = midi.sendNextSequence if verb == 'next' else midi.sendPrevSequence
+
+                if quantize:
+                    calls.append((func, ()))
+                else:
+                    steps.append((STEP_CALL, (func, verb)))
+
+            elif verb == 'console':
+                steps.append((STEP_CALL, (console, None)))
+
+        self.steps = tuple(steps)
+        self.queued = batch()
+        self.wait = wait
+        self.quantize = quantize
+
+
+def parseChannels(verb, value):
+    if not value:
+        raise ValueError('%s without channels' % verb)
+
+    channels = []
+    for channel in value.split(','):
+        try:
+            channel = int(channel)
+        except ValueError:
+            raise ValueError('invalid channel "%s"' % channel)
+
+        if not channel in CHANNELS:
+            raise ValueError('channel %i out of range' % channel)
+
+        if not channel in channels:
+            channels.append(channel)
+
+    return channels
+
+
+def parseWait(value):
+    """parses the argument of wait=, e.g. beat, bar, 2beats or 4bars"""
+    count = value.rstrip('s')
+
+    for unit in WAIT_UNITS:
+        if count.endswith(unit):
+            count = count[:-len(unit)] or '1'
+
+            if not count.isdigit() or int(count) < 1:
+                break
+
+            return (unit, int(count))
+
+    raise ValueError('invalid wait "%s"' % value)
+
+
+def compileCommand(source):
+    ops = []
+
+    for token in source.split():
+        verb, _sep, value = token.partition('=')
+
+        if verb in ('mute', 'unmute'):
+            for channel in parseChannels(verb, value):
+                ops.append((verb, channel))
+
+        elif verb in ('only', 'not'):
+            selected = parseChannels(verb, value)
+            others = [c for c in CHANNELS if not c in selected]
+
+            if verb == 'only':
+                unmutes, mutes = selected, others
+            else:
+                unmutes, mutes = others, selected
+
+            ops += [('unmute', c) for c in unmutes]
+            ops += [('mute', c) for c in mutes]
+
+        elif verb == 'wait' and value:
+            ops.append((verb, parseWait(value)))
+
+        elif verb in ('next', 'prev', 'wait', 'console'):
+            if value:
+                raise ValueError('%s takes no arguments' % verb)
+
+            ops.append((verb, None))
+
+        else:
+            raise ValueError('unknown command "%s"' % token)
+
+    return CommandProgram(source, tuple(ops))
+
+
+def parseColor(value, colors):
+    index = int(value)
+    if index < 0 or index >= len(colors):
+        raise IndexError(value)
+
+    return colors[index]
+
+
+def compileLine(line, colors):
+    text = line.rstrip('\r\n')
+    fgcolor = colors[1]
+
+    if text.startswith('BLINK:'):
+        return PageLine(LINE_BLINK, text[6:].strip(), fgcolor)
+
+    elif text.startswith(':MOUSEPOS'):
+        return PageLine(LINE_MOUSEPOS, '', fgcolor)
+
+    elif text.startswith('BGCOLOR:') or text.startswith('FGCOLOR:'):
+        directive = text[:8]
+        color, _sep, text = text[8:].strip().partition(' ')
+
+        try:
+            color = parseColor(color, colors)
+        except (ValueError, IndexError):
+            raise ValueError('invalid color "%s"' % color)
+
+        if directive == 'BGCOLOR:':
+            return PageLine(LINE_STATIC, text, fgcolor, bgcolor=color)
+        else:
+            return PageLine(LINE_STATIC, text, color)
+
+    return PageLine(LINE_STATIC, text, fgcolor)
+
+
+class PageIndex:
+    """page names in setlist order, with constant time lookup of a page's
+    neighbours and case-insensitive search by prefix or substring"""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.folded = [name.casefold() for name in self.names]
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def next(self, name):
+        """returns the page after the given one, or None on the last page"""
+        i = self.positions[name] +1
+        return self.names[i] if i < len(self.names) else None
+
+    def prev(self, name):
+        """returns the page before the given one, or None on the first page"""
+        i = self.positions[name] -1
+        return self.names[i] if i >= 0 else None
+
+    def find(self, query):
+        """returns the names matching the query, prefix matches first"""
+        query = query.casefold()
+        if not query:
+            return []
+
+        prefix = []
+        substring = []
+
+        for name, folded in zip(self.names, self.folded):
+            if folded.startswith(query):
+                prefix.append(name)
+            elif query in folded:
+                substring.append(name)
+
+        return prefix + substring
+
+
+def splitBlocks(rawlines):
+    """splits the lines of a pages file into (name, line number, lines) per
+    PAGE: block, the line number being that of the first line after the
+    PAGE: header; lines before the first header get the name None"""
+
+    blocks = []
+    name = None
+    first = 1
+    lines = []
+
+    for i, line in enumerate(rawlines):
+        if line.startswith('PAGE:'):
+            if name is not None or lines:
+                blocks.append((name, first, lines))
+
+            name = line.split(':')[1].strip()
+            first = i +2
+            lines = []
+        else:
+            lines.append(line)
+
+    if name is not None or lines:
+        blocks.append((name, first, lines))
+
+    return blocks
+
+
+def compileBlock(name, first, lines, colors):
+    """compiles the lines of one PAGE: block into a Page and a dict of
+    unbound CommandPrograms; returns (page, cmds, errors)"""
+
+    page = Page(name) if name is not None else None
+    cmds = {}
+    errors = []
+
+    for i, line in enumerate(lines, first):
+        if line.startswith('---'):
+            continue
+
+        elif line.startswith('CMD:'):
+            try:
+                cmd_key, cmd_exec = line[4:].strip().split(' ', 1)
+            except ValueError:
+                errors.append('line %i: incomplete command' % i)
+                continue
+
+            if page is None:
+                errors.append('line %i: command outside of page' % i)
+                continue
+
+            try:
+                cmds[cmd_key] = compileCommand(cmd_exec)
+            except ValueError as e:
+                errors.append('line %i: %s' % (i, e))
+
+        elif page is not None:
+            try:
+                page.addLine(compileLine(line, colors))
+            except ValueError as e:
+                errors.append('line %i: %s' % (i, e))
+                page.addLine(PageLine(LINE_STATIC, line.rstrip('\r\n'), colors[1]))
+
+    return page, cmds, errors
+
+
+class PageFile:
+    """compiled contents of a pages file; update() only recompiles the
+    PAGE: blocks whose text changed since the last update.
+
+    blocks maps page names to (source, page, cmds, errors)"""
+
+    def __init__(self, colors):
+        self.colors = colors
+
+        self.blocks = {}
+        self.pages = {}
+        self.pageCmds = {}
+
+    def update(self, rawlines):
+        """returns the names of the pages that were (re)compiled, the names of
+        the pages that were removed and the errors found in the recompiled
+        blocks"""
+
+        blocks = {}
+        pages = {}
+        pageCmds = {}
+
+        changed = []
+        errors = []
+
+        for name, first, lines in splitBlocks(rawlines):
+            source = ''.join(lines)
+
+            if name in self.blocks and self.blocks[name][0] == source:
+                source, page, cmds, blockErrors = self.blocks[name]
+            else:
+                page, cmds, blockErrors = compileBlock(name, first, lines, self.colors)
+                errors += blockErrors
+
+                if name is None:
+                    continue
+
+                print('found page:', name)
+                changed.append(name)
+
+            blocks[name] = (source, page, cmds, blockErrors)
+            pages[name] = page
+            if cmds:
+                pageCmds[name] = cmds
+
+        removed = [name for name in self.pages if not name in pages]
+
+        self.blocks = blocks
+        self.pages = pages
+        self.pageCmds = pageCmds
+
+        return changed, removed, errors
+
+
+def compilePages(rawlines, colors):
+    """compiles the lines of a pages file into a dict of Page objects and a
+    dict of unbound CommandPrograms per page; malformed lines are reported
+    in a list of error messages instead of raising"""
+
+    pageFile = PageFile(colors)
+    changed, removed, errors = pageFile.update(rawlines)
+
+    return pageFile.pages, pageFile.pageCmds, errors
@@ -0,0 +1,371 @@
+import ctypes
+import ctypes.util
+import subprocess
+import threading
+import time
+import mmap
+
+from wurolib import print
+
+import wavfile
+
+
+BLOCK_FRAMES = 2048     # frames written to the device at once, ~46 ms at 44.1 kHz
+LATENCY = 0.1           # seconds of audio buffered by the device
+
+# alsa constants
+SND_PCM_STREAM_PLAYBACK = 0
+SND_PCM_ACCESS_RW_INTERLEAVED = 3
+SND_PCM_FORMATS = {1: 1,    # U8
+                   2: 2,    # S16_LE
+                   3: 32,   # S24_3LE
+                   4: 10,   # S32_LE
+                   }
+
+
+def loadAlsa():
+    try:
+        lib = ctypes.CDLL(ctypes.util.find_library('asound') or 'libasound.so.2')
+    except OSError:
+        return None
+
+    lib.snd_pcm_open.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
+    lib.snd_pcm_set_params.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_uint,
+                                       ctypes.c_uint, ctypes.c_int, ctypes.c_uint]
+    lib.snd_pcm_writei.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulong]
+    lib.snd_pcm_writei.restype = ctypes.c_long
+    lib.snd_pcm_recover.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+    lib.snd_pcm_drop.argtypes = [ctypes.c_void_p]
+    lib.snd_pcm_prepare.argtypes = [ctypes.c_void_p]
+    lib.snd_pcm_drain.argtypes = [ctypes.c_void_p]
+    lib.snd_pcm_close.argtypes = [ctypes.c_void_p]
+
+    return lib
+
+
+class AlsaSink:
+    """writes pcm data to an alsa device through libasound; write() blocks
+    while the device buffer is full"""
+
+    def __init__(self, device, channels, rate, sampleWidth):
+        self.lib = loadAlsa()
+        if self.lib is None:
+            raise OSError('libasound not available')
+
+        if not sampleWidth in SND_PCM_FORMATS:
+            raise OSError('unsupported sample width %i' % sampleWidth)
+
+        self.frameSize = channels * sampleWidth
+        self.pcm = ctypes.c_void_p()
+
+        err = self.lib.snd_pcm_open(ctypes.byref(self.pcm), device.encode(), SND_PCM_STREAM_PLAYBACK, 0)
+        if err < 0:
+            raise OSError('could not open %s (%i)' % (device, err))
+
+        err = self.lib.snd_pcm_set_params(self.pcm, SND_PCM_FORMATS[sampleWidth], SND_PCM_ACCESS_RW_INTERLEAVED,
+                                          channels, rate, 1, int(LATENCY * 1000000))
+        if err < 0:
+            self.lib.snd_pcm_close(self.pcm)
+            raise OSError('could not configure %s (%i)' % (device, err))
+
+    def write(self, data):
+        buf = (ctypes.c_char * len(data)).from_buffer_copy(data)
+        frames = len(data) // self.frameSize
+        done = 0
+
+        while done < frames:
+            n = self.lib.snd_pcm_writei(self.pcm, ctypes.byref(buf, done * self.frameSize), frames - done)
+
+            if n < 0:
+                # underruns happen after pauses, recover and retry
+                if self.lib.snd_pcm_recover(self.pcm, n, 1) < 0:
+                    raise OSError('alsa write failed (%i)' % n)
+                continue
+
+            done += n
+
+    def drop(self):
+        """discards the buffered data, so a pause or seek is heard at once"""
+        self.lib.snd_pcm_drop(self.pcm)
+        self.lib.snd_pcm_prepare(self.pcm)
+
+    def close(self):
+        self.lib.snd_pcm_drain(self.pcm)
+        self.lib.snd_pcm_close(self.pcm)
+
+
+class PipeSink:
+    """fallback for systems without libasound: one aplay process per audio
+    format, fed through a pipe, instead of one process per file"""
+
+    FORMATS = {1: 'U8', 2: 'S16_LE', 3: 'S24_3LE', 4: 'S32_LE'}
+
+    def __init__(self, device, channels, rate, sampleWidth):
+        self.process = subprocess.Popen(['aplay',
+                                         '-D', device,
+                                         '-t', 'raw',
+                                         '-f', self.FORMATS[sampleWidth],
+                                         '-c', str(channels),
+                                         '-r', str(rate),
+                                         '-q',
+                                         ],
+                                         stdin=subprocess.PIPE)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def drop(self):
+        pass
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+        self.process.wait()
+
+
+class NullSink:
+    """discards the data, in real time unless realtime is False"""
+
+    def __init__(self, channels, rate, sampleWidth, realtime=True):
+        self.bytesPerSecond = channels * rate * sampleWidth
+        self.realtime = realtime
+
+    def write(self, data):
+        if self.realtime:
+            time.sleep(len(data) / self.bytesPerSecond)
+
+    def drop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileSink(NullSink):
+    """appends the raw pcm data to a file, for testing without a device"""
+
+    def __init__(self, path, channels, rate, sampleWidth, realtime=False):
+        super().__init__(channels, rate, sampleWidth, realtime)
+        self.file = open(path, 'ab')
+
+    def write(self, data):
+        self.file.write(data)
+        super().write(data)
+
+    def close(self):
+        self.file.close()
+
+
+def openSink(device, channels, rate, sampleWidth):
+    """device is an alsa device name, 'null' or 'file:PATH'"""
+
+    if device == 'null':
+        return NullSink(channels, rate, sampleWidth)
+
+    if device.startswith('file:'):
+        return FileSink(device[len('file:'):], channels, rate, sampleWidth)
+
+    try:
+        return AlsaSink(device, channels, rate, sampleWidth)
+    except OSError as e:
+        print('alsa: %s, using aplay' % e)
+        return PipeSink(device, channels, rate, sampleWidth)
+
+
+class Player:
+    """plays wave files in a thread of its own, streaming blocks of the
+    memory-mapped file to a sink. the sink stays open between files of
+    the same format, so playback starts without delay.
+
+    onFinished is called from the player thread when the playback of a file
+    has ended by itself, at the end of the file or because of an error"""
+
+    def __init__(self, device='default', onFinished=None):
+        self.device = device
+        self.onFinished = onFinished
+
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = None
+
+        self.path = None
+        self.info = None
+        self.generation = 0     # incremented for every new file
+        self.position = 0       # in frames
+        self.paused = False
+        self.flush = False      # the sink has to drop its buffered data
+
+        self.sink = None
+        self.sinkFormat = None
+
+    def play(self, path):
+        """raises OSError or ValueError if the file cannot be played"""
+        info = wavfile.readInfo(path)
+
+        with self.cond:
+            self.path = path
+            self.info = info
+            self.generation += 1
+            self.position = 0
+            self.paused = False
+            self.flush = True
+            self.cond.notify()
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name='playback', daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.path = None
+            self.info = None
+            self.generation += 1
+            self.flush = True
+            self.cond.notify()
+
+    def setPaused(self, paused):
+        with self.cond:
+            if self.path is not None and paused != self.paused:
+                self.paused = paused
+                self.flush = paused
+                self.cond.notify()
+
+    def togglePause(self):
+        with self.cond:
+            self.setPaused(not self.paused)
+
+    def seek(self, seconds):
+        with self.cond:
+            if self.info is None:
+                return
+
+            frame = int(seconds * self.info.rate)
+            self.position = max(0, min(frame, self.info.frames))
+            self.flush = True
+            self.cond.notify()
+
+    def getPosition(self):
+        """returns (path, position, duration, paused) in seconds, or None if
+        nothing is being played"""
+        with self.cond:
+            if self.info is None:
+                return None
+
+            return self.path, self.position / self.info.rate, self.info.duration, self.paused
+
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+        if self.thread:
+            self.thread.join(1)
+
+    def getSink(self, info):
+        sinkFormat = (info.channels, info.rate, info.sampleWidth)
+
+        if self.sinkFormat != sinkFormat:
+            if self.sink:
+                self.sink.close()
+                self.sink = None
+                self.sinkFormat = None
+
+            self.sink = openSink(self.device, *sinkFormat)
+            self.sinkFormat = sinkFormat
+
+        return self.sink
+
+    def _finish(self, generation, error=None):
+        with self.cond:
+            if self.generation != generation:
+                return
+
+            self.path = None
+            self.info = None
+
+        if error:
+            print('playback failed:', error)
+
+        if self.onFinished:
+            self.onFinished()
+
+    def _run(self):
+        playing = None      # generation, file and mmap of the file being played
+
+        try:
+            while True:
+                with self.cond:
+                    while self.running and not self.flush and (self.path is None or self.paused):
+                        self.cond.wait()
+
+                    if not self.running:
+                        break
+
+                    flush, self.flush = self.flush, False
+                    generation, path, info = self.generation, self.path, self.info
+                    idle = path is None or self.paused
+
+                    if not idle:
+                        start = self.position
+                        end = min(start + BLOCK_FRAMES, info.frames)
+                        self.position = end
+
+                if flush and self.sink:
+                    self.sink.drop()
+
+                if playing and (idle and path is None or playing[0] != generation):
+                    playing[2].close()
+                    playing[1].close()
+                    playing = None
+
+                if idle:
+                    continue
+
+                if start >= info.frames:
+                    self._finish(generation)
+                    continue
+
+                try:
+                    if playing is None:
+                        f = open(path, 'rb')
+                        try:
+                            playing = (generation, f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+                        except (OSError, ValueError):
+                            f.close()
+                            raise
+
+                    sink = self.getSink(info)
+
+                except (OSError, ValueError) as e:
+                    # a deleted or truncated file, or no sink for its format
+                    self._finish(generation, e)
+                    continue
+
+                offset = info.dataOffset + start * info.frameSize
+                size = (end - start) * info.frameSize
+
+                try:
+                    with memoryview(playing[2]) as view, view[offset:offset + size] as block:
+                        sink.write(block)
+
+                except (OSError, ValueError) as e:
+                    # the sink is reopened for the next file
+                    try:
+                        sink.close()
+                    except (OSError, ValueError):
+                        pass
+
+                    self.sink = None
+                    self.sinkFormat = None
+
+                    self._finish(generation, e)
+        finally:
+            if playing:
+                playing[2].close()
+                playing[1].close()
+
+            if self.sink:
+                self.sink.close()
@@ -0,0 +1,188 @@
+import ctypes.util
+import collections
+import threading
+import ctypes
+import struct
+import time
+import os
+
+from wurolib import print
+
+import wavfile
+
+
+DATA_OFFSET = 4096          # the pcm data starts on a block boundary
+CHUNK_SIZE = 256 * 1024     # bytes written at once, a multiple of the erase block size
+MAX_BUFFER = 8 * 1024 * 1024    # bytes queued before data is dropped, ~47 s of cd audio
+PATCH_INTERVAL = 2          # seconds between updates of the header on disk
+STALL_TIME = 0.1            # writes taking longer than this are counted as stalls
+
+SIZE_FIELD = struct.Struct('<I')
+
+FALLOC_FL_KEEP_SIZE = 1     # reserve blocks without extending (and zero-filling) the file
+
+
+def loadFallocate():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fallocate = libc.fallocate
+    except (OSError, AttributeError):
+        return None
+
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    return fallocate
+
+
+class RecordingWriter:
+    """writes a wave file from a thread of its own, so a stalling usb stick
+    does not hold up reading from the capture device.
+
+    write() only queues the data; the writer thread writes it in chunks of
+    CHUNK_SIZE at aligned offsets and patches the sizes in the header every
+    PATCH_INTERVAL seconds, so the file stays playable if power is lost.
+    if more than MAX_BUFFER bytes are waiting, new data is dropped and
+    counted instead of blocking the caller.
+
+    with preallocate > 0 the writer thread first reserves that many bytes
+    of disk space for the data, where the file system supports it without
+    writing them"""
+
+    def __init__(self, path, channels, rate, sampleWidth, preallocate=0):
+        self.path = path
+        self.frameSize = channels * sampleWidth
+
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.write(self.fd, wavfile.buildHeader(channels, rate, sampleWidth, DATA_OFFSET, 0))
+
+        self.preallocate = preallocate
+
+        self.cond = threading.Condition()
+        self.queue = collections.deque()
+        self.queued = 0
+        self.closing = False
+        self.onClosed = None
+
+        self.dataSize = 0
+
+        # statistics
+        self.highWater = 0
+        self.dropped = 0
+        self.stalls = 0
+        self.longestWrite = 0
+
+        self.thread = threading.Thread(target=self._run, name='recorder', daemon=True)
+        self.thread.start()
+
+    def write(self, data):
+        with self.cond:
+            if self.queued + len(data) > MAX_BUFFER:
+                self.dropped += len(data)
+                return
+
+            self.queue.append(data)
+            self.queued += len(data)
+            self.highWater = max(self.highWater, self.queued)
+            self.cond.notify()
+
+    def finish(self, onClosed=None):
+        """has the writer thread write the rest of the queue and close the
+        file, without waiting for it; onClosed is then called with the
+        stats() from the writer thread"""
+        with self.cond:
+            self.closing = True
+            self.onClosed = onClosed
+            self.cond.notify()
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    def close(self):
+        self.finish()
+        self.join()
+
+    def stats(self):
+        with self.cond:
+            return {'written': self.dataSize,
+                    'queued': self.queued,
+                    'highWater': self.highWater,
+                    'dropped': self.dropped,
+                    'stalls': self.stalls,
+                    'longestWrite': self.longestWrite,
+                    }
+
+    def patchHeader(self):
+        os.pwrite(self.fd, SIZE_FIELD.pack(DATA_OFFSET - 8 + self.dataSize), 4)
+        os.pwrite(self.fd, SIZE_FIELD.pack(self.dataSize), DATA_OFFSET - SIZE_FIELD.size)
+        os.fdatasync(self.fd)
+
+    def reserveSpace(self):
+        fallocate = loadFallocate()
+
+        if fallocate and fallocate(self.fd, FALLOC_FL_KEEP_SIZE, DATA_OFFSET, self.preallocate) != 0:
+            print('could not preallocate recording:', os.strerror(ctypes.get_errno()))
+
+    def writeChunk(self, chunk):
+        start = time.monotonic()
+
+        view = memoryview(chunk)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+        duration = time.monotonic() - start
+
+        with self.cond:
+            self.dataSize += len(chunk)
+            self.longestWrite = max(self.longestWrite, duration)
+            if duration > STALL_TIME:
+                self.stalls += 1
+
+    def _run(self):
+        pending = bytearray()
+        lastPatch = 0   # the header is patched after the first chunk
+
+        if self.preallocate:
+            self.reserveSpace()
+
+        try:
+            while True:
+                with self.cond:
+                    if not self.queue and not self.closing:
+                        self.cond.wait(PATCH_INTERVAL)
+
+                    while self.queue:
+                        data = self.queue.popleft()
+                        self.queued -= len(data)
+                        pending += data
+
+                    closing = self.closing
+
+                # whole chunks only, except for the rest when closing
+                size = len(pending) if closing else len(pending) - len(pending) % CHUNK_SIZE
+                size -= size % self.frameSize
+
+                if size:
+                    self.writeChunk(pending[:size])
+                    del pending[:size]
+
+                now = time.monotonic()
+                if closing or now - lastPatch >= PATCH_INTERVAL:
+                    self.patchHeader()
+                    lastPatch = now
+
+                if closing:
+                    break
+        except OSError as e:
+            print('recording failed:', e)
+
+        if self.preallocate:
+            # frees the space reserved beyond the end of the file
+            try:
+                os.ftruncate(self.fd, DATA_OFFSET + self.dataSize)
+            except OSError:
+                pass
+
+        os.close(self.fd)
+
+        if self.onClosed:
+            self.onClosed(self.stats())
@@ -0,0 +1,93 @@
+import threading
+import os
+
+from wurolib import print
+
+import wavfile
+
+
+SORT_DATE = 'date'      # newest first
+SORT_NAME = 'name'
+
+
+class Recording:
+    __slots__ = ('name', 'path', 'mtime', 'size', 'duration')
+
+    def __init__(self, name, path, mtime, size, duration):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.duration = duration    # None if the header could not be read
+
+
+class RecordingIndex:
+    """the wave files in a directory; refresh() only parses the headers of
+    files which are new or changed since the last refresh"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        self.lock = threading.Lock()
+        self.known = {}         # name -> Recording
+        self.version = 0        # incremented whenever the list changes
+
+        self.recordings = ()
+        self.sortOrder = SORT_DATE
+
+    def refresh(self):
+        """returns True if the list of recordings changed"""
+        known = {}
+        changed = False
+
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith('.wav') or not entry.is_file():
+                        continue
+
+                    st = entry.stat()
+                    recording = self.known.get(entry.name)
+
+                    if recording is None or recording.mtime != st.st_mtime_ns or recording.size != st.st_size:
+                        recording = Recording(entry.name, entry.path, st.st_mtime_ns, st.st_size, self.readDuration(entry.path))
+                        changed = True
+
+                    known[entry.name] = recording
+        except OSError as e:
+            print('could not list recordings:', e)
+            return False
+
+        if len(known) != len(self.known):
+            changed = True
+
+        if changed:
+            with self.lock:
+                self.known = known
+                self.recordings = self.sorted(known.values())
+                self.version += 1
+
+        return changed
+
+    def readDuration(self, path):
+        try:
+            return wavfile.readInfo(path).duration
+        except (OSError, ValueError):
+            return None
+
+    def sorted(self, recordings):
+        if self.sortOrder == SORT_DATE:
+            return tuple(sorted(recordings, key=lambda r: (r.mtime, r.name), reverse=True))
+
+        return tuple(sorted(recordings, key=lambda r: r.name))
+
+    def setSortOrder(self, sortOrder):
+        with self.lock:
+            self.sortOrder = sortOrder
+            self.recordings = self.sorted(self.known.values())
+            self.version += 1
+
+    def getRecordings(self):
+        """returns (version, recordings)"""
+        with self.lock:
+            return self.version, self.recordings
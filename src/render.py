@@ -0,0 +1,137 @@
+import collections
+
+import pygame
+import wurolib
+
+from pages import LINE_STATIC
+
+
+class LRUCache:
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, create):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            value = create()
+            self.entries[key] = value
+
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return value
+
+    def invalidate(self, match):
+        for key in [key for key in self.entries if match(key)]:
+            del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+
+def renderPageSurface(textCache, output, page, bgcolor):
+    """renders the static lines of a page into an off-screen copy of the
+    output surface; dynamic lines are left empty and drawn on top later"""
+
+    surface = output.copy()
+    surface.fill(bgcolor)
+
+    for line in page.lines:
+        if line.kind == LINE_STATIC:
+            textCache.center(surface, line.text, 0.5 + line.row, line.fgcolor, line.bgcolor)
+
+    return surface
+
+
+class DirtyScreen(wurolib.Screen):
+    """screen that keeps track of the parts of the output that changed
+    since the last frame, so only those have to be pushed to the display"""
+
+    def __init__(self, context, textCache):
+        super().__init__(context)
+
+        self.textCache = textCache
+
+        self.fullRedraw = True
+        self.dirtyRects = []
+        self.layerStates = {}
+
+    def drawText(self, text, x, y, fgcolor, bgcolor=None):
+        self.textCache.print(self.context.output, text, x, y, fgcolor, bgcolor)
+
+    def centerText(self, text, y, fgcolor, bgcolor=None):
+        self.textCache.center(self.context.output, text, y, fgcolor, bgcolor)
+
+    def invalidate(self):
+        self.fullRedraw = True
+        self.layerStates.clear()
+
+    def markDirty(self, rect):
+        self.dirtyRects.append(pygame.Rect(rect))
+
+    def takeDirtyRects(self):
+        """returns the rects changed since the last call, or None if the
+        whole screen has to be updated"""
+        rects = self.dirtyRects
+        self.dirtyRects = []
+
+        if self.fullRedraw:
+            self.fullRedraw = False
+            return None
+
+        return rects
+
+    def changed(self, key, state):
+        if key in self.layerStates and self.layerStates[key] == state:
+            return False
+
+        self.layerStates[key] = state
+        return True
+
+    def renderLayers(self, background, layers):
+        """draws layers of (key, state, rect, draw) tuples over a background
+        surface; only layers whose state changed, and layers overlapping
+        those, are redrawn and marked dirty"""
+
+        output = self.context.output
+
+        if self.fullRedraw:
+            output.blit(background, (0, 0))
+
+            for key, state, rect, draw in layers:
+                self.changed(key, state)
+                draw()
+            return
+
+        redraw = [layer for layer in layers if self.changed(layer[0], layer[1])]
+        if not redraw:
+            return
+
+        # restoring the background under a layer erases parts of the layers
+        # it overlaps, so these have to be redrawn as well
+        dirty = [layer[2] for layer in redraw]
+        while True:
+            more = [layer for layer in layers if layer not in redraw and layer[2].collidelist(dirty) >= 0]
+            if not more:
+                break
+
+            redraw += more
+            dirty += [layer[2] for layer in more]
+
+        for rect in dirty:
+            output.blit(background, rect, rect)
+
+        for layer in layers:
+            if layer in redraw:
+                layer[3]()
+
+        self.dirtyRects += dirty
@@ -0,0 +1,205 @@
+import collections
+import threading
+import traceback
+import heapq
+import time
+import math
+
+from wurolib import print
+
+from ioloop import Timer
+
+
+TICKS_PER_BEAT = 24     # midi clock resolution
+BEATS_PER_BAR = 4       # midi clock carries no time signature
+TICKS_PER_SIXTEENTH = TICKS_PER_BEAT // 4
+
+SMOOTHING = 0.1         # weight of a new interval in the tick period estimate
+MAX_GAP = 4             # ticks without clock after which the clock is considered lost
+
+SPIN_TIME = 0.002       # the last part of a wait polls the clock, sleeping is not precise enough
+JITTER_SAMPLES = 256    # recent timings kept for the statistics
+
+UNITS = {'beat': TICKS_PER_BEAT,
+         'bar': TICKS_PER_BEAT * BEATS_PER_BAR,
+         }
+
+
+class BeatClock:
+    """follows the midi clock, start/stop/continue and song position
+    messages to predict when upcoming beats and bars will happen.
+
+    times are time.monotonic() seconds; the tick count starts at 0 on the
+    downbeat of the song's first bar"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+        self.running = False
+        self.tick = -1          # the next clock message is tick + 1
+        self.lastTime = None    # time of the last clock message
+        self.period = None      # estimated seconds per tick
+
+    def start(self):
+        with self.lock:
+            self.running = True
+            self.tick = -1
+
+    def resume(self):
+        with self.lock:
+            self.running = True
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+
+    def songPosition(self, sixteenths):
+        with self.lock:
+            self.tick = sixteenths * TICKS_PER_SIXTEENTH -1
+
+    def clock(self, t):
+        with self.lock:
+            if self.lastTime is not None:
+                interval = t - self.lastTime
+
+                if self.period is None or interval > MAX_GAP * self.period:
+                    self.period = interval
+                else:
+                    self.period += (interval - self.period) * SMOOTHING
+
+            self.lastTime = t
+
+            if self.running:
+                self.tick += 1
+
+    def getTempo(self):
+        """returns the tempo in bpm, or None if unknown"""
+        with self.lock:
+            if self.period is None:
+                return None
+
+            return 60 / (self.period * TICKS_PER_BEAT)
+
+    def nextBoundary(self, unit, count, now):
+        """returns the time of the next multiple of count units ('beat' or
+        'bar') after now, or None if the clock is not running"""
+
+        with self.lock:
+            if not self.running or self.period is None or self.lastTime is None or self.tick < 0:
+                return None
+
+            if now - self.lastTime > MAX_GAP * self.period:
+                return None     # clock messages stopped arriving
+
+            ticks = UNITS[unit] * count
+            position = self.tick + (now - self.lastTime) / self.period
+            boundary = (math.floor(position / ticks) +1) * ticks
+
+            return self.lastTime + (boundary - self.tick) * self.period
+
+
+class Scheduler:
+    """calls functions at given time.monotonic() deadlines from a thread of
+    its own, sleeping until shortly before a deadline and polling the clock
+    for the rest of the wait. the lateness of each call and the time it
+    took are kept for the statistics"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.timers = []
+        self.timerSeq = 0
+
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+
+        self.lateness = collections.deque(maxlen=JITTER_SAMPLES)
+        self.durations = collections.deque(maxlen=JITTER_SAMPLES)
+        self.calls = 0
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def callAt(self, deadline, callback, *args):
+        timer = Timer(deadline, callback, args)
+
+        with self.cond:
+            heapq.heappush(self.timers, (deadline, self.timerSeq, timer))
+            self.timerSeq += 1
+            self.cond.notify()
+
+        return timer
+
+    def pending(self):
+        with self.cond:
+            return sum(1 for deadline, seq, timer in self.timers if not timer.cancelled)
+
+    def stats(self):
+        """returns the number of calls and the mean, 95th percentile and
+        maximum lateness and duration of the recent calls in ms"""
+
+        with self.cond:
+            lateness = sorted(self.lateness)
+            durations = sorted(self.durations)
+            calls = self.calls
+
+        def summary(values):
+            if not values:
+                return None
+
+            return (sum(values) / len(values) * 1000,
+                    values[min(len(values) -1, int(len(values) * 0.95))] * 1000,
+                    values[-1] * 1000)
+
+        return {'calls': calls,
+                'lateness': summary(lateness),
+                'duration': summary(durations),
+                }
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.timers:
+                    self.cond.wait()
+
+                if not self.running:
+                    break
+
+                deadline, seq, timer = self.timers[0]
+                remaining = deadline - time.monotonic()
+
+                if remaining > SPIN_TIME:
+                    self.cond.wait(remaining - SPIN_TIME)
+                    continue
+
+                heapq.heappop(self.timers)
+
+            if timer.cancelled:
+                continue
+
+            while time.monotonic() < deadline:
+                time.sleep(0)
+
+            if timer.cancelled:
+                continue    # cancelled while spinning
+
+            start = time.monotonic()
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                print(traceback.format_exc())
+
+            end = time.monotonic()
+
+            with self.cond:
+                self.calls += 1
+                self.lateness.append(start - deadline)
+                self.durations.append(end - start)
@@ -0,0 +1,33 @@
+import time
+
+from wurolib import print
+
+
+def getUptime():
+    """seconds since the system was booted, or None if unknown"""
+    try:
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """measures the duration of the phases of a startup sequence"""
+
+    def __init__(self, name, start=None):
+        self.name = name
+        self.start = time.monotonic() if start is None else start
+        self.last = self.start
+        self.phases = []
+
+    def phase(self, name):
+        now = time.monotonic()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        for name, duration in self.phases:
+            print('%s: %-12s %6.1f ms' % (self.name, name, duration * 1000))
+
+        print('%s: %-12s %6.1f ms' % (self.name, 'total', (self.last - self.start) * 1000))
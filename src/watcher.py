@@ -0,0 +1,141 @@
+import ctypes
+import ctypes.util
+import struct
+import os
+
+from wurolib import print
+
+
+POLL_INTERVAL = 1       # seconds between checks if inotify is not available
+SETTLE_DELAY = 0.2      # editors often write files in several steps
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVED_FROM = 0x00000040
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def loadInotify():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+
+class FileWatcher:
+    """calls callback whenever the watched file has changed; uses inotify
+    on the file's directory if available, so files replaced by editors are
+    noticed as well, and compares the file's mtime and size periodically
+    otherwise.
+
+    if path is a directory, changes of any file in it are reported.
+
+    the events are handled by the given ioloop.IOLoop; the file is checked
+    and callback is called from the thread of worker, an ioloop.Worker, or
+    from the loop thread without one"""
+
+    def __init__(self, loop, path, callback, worker=None):
+        self.loop = loop
+        self.worker = worker
+        self.path = path
+        self.callback = callback
+        self.isDirectory = os.path.isdir(path)
+
+        self.fd = None
+        self.timer = None
+        self.lastStat = self.stat()
+
+    def stat(self):
+        try:
+            if self.isDirectory:
+                with os.scandir(self.path) as entries:
+                    return frozenset((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                                     for entry in entries)
+
+            st = os.stat(self.path)
+        except OSError:
+            return None
+
+        return st.st_mtime_ns, st.st_size
+
+    def start(self):
+        libc = loadInotify()
+
+        if libc is not None:
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if self.isDirectory:
+                # not IN_MODIFY, which would report every write to a
+                # recording in progress
+                directory = self.path
+                mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE
+            else:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+            if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(directory), mask) >= 0:
+                self.fd = fd
+                self.loop.addReader(fd, self._readEvents)
+                return
+
+            if fd >= 0:
+                os.close(fd)
+
+        print('inotify not available, polling %s' % self.path)
+        self.timer = self.loop.callLater(POLL_INTERVAL, self._poll)
+
+    def stop(self):
+        if self.fd is not None:
+            self.loop.removeReader(self.fd)
+            self.loop.callSoon(os.close, self.fd)
+            self.fd = None
+
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _readEvents(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+
+        filename = os.fsencode(os.path.basename(self.path))
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+
+            if name == filename or self.isDirectory:
+                if self.timer:
+                    self.timer.cancel()
+                self.timer = self.loop.callLater(SETTLE_DELAY, self._submitCheck)
+
+    def _poll(self):
+        self._submitCheck()
+        self.timer = self.loop.callLater(POLL_INTERVAL, self._poll)
+
+    def _submitCheck(self):
+        if self.worker:
+            self.worker.submit(self._check)
+        else:
+            self._check()
+
+    def _check(self):
+        stat = self.stat()
+
+        if stat is not None and stat != self.lastStat:
+            self.lastStat = stat
+            self.callback()
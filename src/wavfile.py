@@ -0,0 +1,122 @@
+import struct
+import mmap
+import os
+
+
+# header of a RIFF WAVE file as written by the wave module and arecord
+
+RIFF_HEADER = struct.Struct('<4sI4s')   # 'RIFF', size, 'WAVE'
+CHUNK_HEADER = struct.Struct('<4sI')    # id, size
+FMT_CHUNK = struct.Struct('<HHIIHH')    # format, channels, rate, byte rate, block align, bits
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+MAX_HEADER_SIZE = 65536     # the data chunk has to start within this range
+
+
+class WavInfo:
+    __slots__ = ('channels', 'rate', 'sampleWidth', 'dataOffset', 'dataSize')
+
+    def __init__(self, channels, rate, sampleWidth, dataOffset, dataSize):
+        self.channels = channels
+        self.rate = rate
+        self.sampleWidth = sampleWidth
+        self.dataOffset = dataOffset
+        self.dataSize = dataSize
+
+    @property
+    def frameSize(self):
+        return self.channels * self.sampleWidth
+
+    @property
+    def frames(self):
+        return self.dataSize // self.frameSize
+
+    @property
+    def duration(self):
+        return self.frames / self.rate
+
+
+def buildHeader(channels, rate, sampleWidth, dataOffset, dataSize):
+    """returns the header of a pcm wave file whose data starts at dataOffset,
+    the space before it is filled with a JUNK chunk"""
+
+    fmtSize = CHUNK_HEADER.size + FMT_CHUNK.size
+    junkSize = dataOffset - RIFF_HEADER.size - fmtSize - 2 * CHUNK_HEADER.size
+    if junkSize < 0:
+        raise ValueError('data offset too small')
+
+    blockAlign = channels * sampleWidth
+
+    return b''.join([RIFF_HEADER.pack(b'RIFF', dataOffset - 8 + dataSize, b'WAVE'),
+                     CHUNK_HEADER.pack(b'fmt ', FMT_CHUNK.size),
+                     FMT_CHUNK.pack(WAVE_FORMAT_PCM, channels, rate, rate * blockAlign, blockAlign, sampleWidth * 8),
+                     CHUNK_HEADER.pack(b'JUNK', junkSize),
+                     bytes(junkSize),
+                     CHUNK_HEADER.pack(b'data', dataSize),
+                     ])
+
+
+def parseHeader(data, fileSize):
+    """parses the header of a wave file from a buffer holding at least its
+    beginning; raises ValueError if it is not a pcm wave file.
+
+    the size of the data chunk is taken from the file size if the header
+    was not finished, e.g. while the file is still being recorded"""
+
+    if len(data) < RIFF_HEADER.size:
+        raise ValueError('file too short')
+
+    riff, size, wave = RIFF_HEADER.unpack_from(data)
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise ValueError('not a wave file')
+
+    fmt = None
+    offset = RIFF_HEADER.size
+
+    while offset + CHUNK_HEADER.size <= len(data):
+        chunkId, chunkSize = CHUNK_HEADER.unpack_from(data, offset)
+        offset += CHUNK_HEADER.size
+
+        if chunkId == b'fmt ':
+            if offset + FMT_CHUNK.size > len(data):
+                break
+            fmt = FMT_CHUNK.unpack_from(data, offset)
+
+        elif chunkId == b'data':
+            if fmt is None:
+                raise ValueError('data before format chunk')
+
+            audioFormat, channels, rate, byteRate, blockAlign, bits = fmt
+            if not audioFormat in (WAVE_FORMAT_PCM, WAVE_FORMAT_EXTENSIBLE):
+                raise ValueError('unsupported format %i' % audioFormat)
+            if not channels or not rate or bits % 8:
+                raise ValueError('invalid format chunk')
+
+            available = fileSize - offset
+            if chunkSize == 0 or chunkSize > available:
+                chunkSize = available
+
+            info = WavInfo(channels, rate, bits // 8, offset, chunkSize)
+            info.dataSize -= info.dataSize % info.frameSize
+            return info
+
+        # chunks are padded to an even size
+        offset += chunkSize + (chunkSize & 1)
+
+    raise ValueError('no data chunk')
+
+
+def readInfo(path):
+    """returns the WavInfo of a wave file; only the pages holding the
+    header are read"""
+
+    with open(path, 'rb') as f:
+        fileSize = os.fstat(f.fileno()).st_size
+        if fileSize == 0:
+            raise ValueError('empty file')
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as view, view[:MAX_HEADER_SIZE] as data:
+                return parseHeader(data, fileSize)
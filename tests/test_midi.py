@@ -0,0 +1,86 @@
+import unittest
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from midi import MidiThread, SysexDecoder
+
+
+class FakeInput:
+    def __init__(self, batches):
+        self.batches = list(batches)
+
+    def poll(self):
+        return bool(self.batches)
+
+    def read(self, count):
+        return self.batches.pop(0) if self.batches else []
+
+
+class SysexTest(unittest.TestCase):
+    def testRealtimeInterleaved(self):
+        received = []
+        decoder = SysexDecoder(callback=received.append)
+
+        self.assertTrue(decoder.feed([0xF0, ord('W'), ord('I'), ord('N')]))
+        self.assertFalse(decoder.feed([0xF8, 0, 0, 0]))
+        self.assertFalse(decoder.feed([0xFE, 0, 0, 0]))
+        self.assertTrue(decoder.feed([ord('T'), 0xF7, 0, 0]))
+
+        self.assertEqual(received, ['WINT'])
+
+    def testRealtimeThroughRead(self):
+        pages = []
+        midi = MidiThread(None, pageCallback=pages.append, coalesce=0, devices=(FakeInput([]), None))
+        midi.clock.start()
+
+        midi.midi_in.batches.append([[[0xF0, ord('W'), ord('I'), ord('N')], 0],
+                                     [[0xF8, 0, 0, 0], 0],
+                                     [[ord('T'), 0xF7, 0, 0], 0],
+                                     ])
+        midi._read()
+        midi._flushPage()
+
+        self.assertEqual(pages, ['WINT'])
+        self.assertEqual(midi.clock.tick, 0)
+
+
+class CoalesceTest(unittest.TestCase):
+    def setUp(self):
+        self.pages = []
+        self.midi = MidiThread(None, pageCallback=self.pages.append, coalesce=10, devices=(FakeInput([]), None))
+
+    def sendPage(self, name):
+        self.midi.midi_in.batches.append([[[0xF0] + list(name.encode()) + [0xF7], 0]])
+        self.midi._read()
+
+    def testFirstPageImmediate(self):
+        self.sendPage('A')
+        self.assertEqual(self.pages, ['A'])
+        self.assertIsNone(self.midi.pendingPage)
+
+    def testBurstKeepsLast(self):
+        for name in ('A', 'B', 'C'):
+            self.sendPage(name)
+
+        self.assertEqual(self.pages, ['A'])
+        self.assertEqual(self.midi.pendingPage, 'C')
+
+        self.midi._flushPage()
+        self.assertEqual(self.pages, ['A', 'C'])
+
+    def testSyncFlushesPending(self):
+        synced = []
+        self.midi.syncCallback = lambda: synced.append(list(self.pages))
+
+        self.sendPage('A')
+        self.sendPage('B')
+        self.midi.midi_in.batches.append([[[0x9F, 60, 100, 0], 0]])
+        self.midi._read()
+
+        self.assertEqual(synced, [['A', 'B']])
+
+
+if __name__ == '__main__':
+    unittest.main()
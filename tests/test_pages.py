@@ -0,0 +1,128 @@
+import unittest.mock
+import unittest
+import tempfile
+import shutil
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import pagecache
+from pages import PageFile
+
+
+COLORS = [(i, i, i) for i in range(16)]
+
+SOURCE = ['PAGE: ONE\n', 'first\n', 'CMD:1 only=1,2\n',
+          'PAGE: TWO\n', 'BGCOLOR:2 second \n',
+          ]
+
+
+class PageFileTest(unittest.TestCase):
+    def testUpdateRecompilesChangedBlocks(self):
+        pageFile = PageFile(COLORS)
+
+        changed, removed, errors = pageFile.update(SOURCE)
+        self.assertEqual(changed, ['ONE', 'TWO'])
+        self.assertEqual(errors, [])
+
+        one = pageFile.pages['ONE']
+
+        changed, removed, errors = pageFile.update(SOURCE[:4] + ['BGCOLOR:3 second\n'])
+        self.assertEqual(changed, ['TWO'])
+        self.assertEqual(removed, [])
+        self.assertIs(pageFile.pages['ONE'], one)
+
+        changed, removed, errors = pageFile.update(SOURCE[:3])
+        self.assertEqual(changed, [])
+        self.assertEqual(removed, ['TWO'])
+
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='prompter-test-')
+        self.path = os.path.join(self.directory, 'pages.txt')
+
+        with open(self.path, 'w') as f:
+            f.writelines(SOURCE)
+
+        # keeps the tests from using or leaving caches in the home directory
+        patch = unittest.mock.patch.object(pagecache, 'CACHE_DIR', os.path.join(self.directory, 'cache'))
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load(self, colors=COLORS):
+        pageFile = PageFile(colors)
+        errors = pagecache.load(pageFile, self.path)
+        return pageFile, errors
+
+    def loadCached(self, colors=COLORS):
+        # fails if the source is compiled instead of the cache being used
+        with unittest.mock.patch.object(PageFile, 'update', side_effect=AssertionError('recompiled')):
+            return self.load(colors)
+
+    def testRoundTrip(self):
+        compiled, errors = self.load()
+        cached, errors = self.loadCached()
+
+        self.assertEqual(list(cached.pages), ['ONE', 'TWO'])
+        self.assertEqual(cached.pages['TWO'].lines[0].text, 'second')
+        self.assertEqual(cached.pages['TWO'].lines[0].bgcolor, COLORS[2])
+        self.assertEqual([program.ops for program in cached.pageCmds['ONE'].values()],
+                         [program.ops for program in compiled.pageCmds['ONE'].values()])
+
+    def testSizeAndMtimeSkipReading(self):
+        self.load()
+        stat = os.stat(self.path)
+
+        # same size and mtime, the source is not read at all
+        with open(self.path, 'w') as f:
+            f.writelines(SOURCE[:1] + ['FIRST\n'] + SOURCE[2:])
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        cached, errors = self.loadCached()
+        self.assertEqual(cached.pages['ONE'].lines[0].text, 'first')
+
+    def testHashAfterTouch(self):
+        self.load()
+
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        cached, errors = self.loadCached()
+        self.assertEqual(list(cached.pages), ['ONE', 'TWO'])
+
+        # the cache was rewritten with the new mtime
+        with open(os.path.join(self.directory, pagecache.CACHE_NAME), 'rb') as f:
+            header = pagecache.HEADER.unpack(f.read(pagecache.HEADER.size))
+
+        self.assertEqual(header[5], stat.st_mtime_ns + 10**9)
+
+    def testChangedSourceRecompiles(self):
+        self.load()
+
+        with open(self.path, 'a') as f:
+            f.write('PAGE: THREE\n')
+
+        pageFile, errors = self.load()
+        self.assertEqual(list(pageFile.pages), ['ONE', 'TWO', 'THREE'])
+
+    def testColorsInvalidate(self):
+        self.load()
+
+        with self.assertRaises(AssertionError):
+            self.loadCached([(255, 0, 0)] + COLORS[1:])
+
+    def testCompilerInvalidates(self):
+        self.load()
+
+        with unittest.mock.patch.object(pagecache, 'COMPILER', b'changed!'):
+            with self.assertRaises(AssertionError):
+                self.loadCached()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,375 @@
+"""benchmarks of the hot paths of the prompter, runnable off the pi.
+
+the app is loaded from src/__main__.py without starting it, with SDL's
+dummy video driver and stand-ins for the midi devices and the audio.
+
+    python3 tools/bench.py [-o results.json] [--compare old.json] [--quick]
+
+results are written as json: per benchmark the number of samples and the
+mean, median, 95th percentile and minimum time per call in microseconds"""
+
+import importlib.util
+import statistics
+import subprocess
+import argparse
+import tempfile
+import platform
+import shutil
+import json
+import time
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC = os.path.join(ROOT, 'src')
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+sys.path.insert(0, SRC)
+
+
+def loadApp():
+    """imports src/__main__.py as module 'prompter', without running main()"""
+    spec = importlib.util.spec_from_file_location('prompter', os.path.join(SRC, '__main__.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['prompter'] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+# -- stand-ins
+
+
+class FakeOutput:
+    """pygame.midi.Output stand-in counting the messages sent"""
+
+    def __init__(self):
+        self.sent = 0
+
+    def note_on(self, note, velocity, channel=0):
+        self.sent += 1
+
+    def note_off(self, note, velocity=0, channel=0):
+        self.sent += 1
+
+
+class FakeInput:
+    """pygame.midi.Input stand-in delivering prepared batches of messages"""
+
+    def __init__(self, batches=()):
+        self.batches = list(batches)
+
+    def poll(self):
+        return bool(self.batches)
+
+    def read(self, count):
+        return self.batches.pop(0) if self.batches else []
+
+
+class FakeAudio:
+    """AudioThread stand-in, not recording and not playing"""
+
+    def isRecording(self):
+        return False
+
+    def isMetering(self):
+        return False
+
+    def getMeter(self):
+        return 0, 0, 0, 0
+
+    def getPlayPosition(self):
+        return None
+
+
+# -- measuring
+
+
+def measure(func, samples, number=1):
+    """returns the times per call of samples runs of number calls, in µs"""
+    times = []
+
+    for i in range(samples):
+        start = time.perf_counter_ns()
+        for j in range(number):
+            func()
+        times.append((time.perf_counter_ns() - start) / number / 1000)
+
+    return times
+
+
+def summarize(times):
+    ordered = sorted(times)
+
+    return {'samples': len(times),
+            'mean': statistics.fmean(times),
+            'median': statistics.median(times),
+            'p95': ordered[min(len(ordered) -1, int(len(ordered) * 0.95))],
+            'min': ordered[0],
+            }
+
+
+# -- synthetic data
+
+
+def makePages(count, linesPerPage=10):
+    """returns the lines of a pages file with count pages of mixed kinds"""
+    lines = ['PAGE: DEFAULT\n', 'benchmark\n', '---\n']
+
+    for i in range(count):
+        lines.append('PAGE: SONG%04i\n' % i)
+        lines.append('------------\n')
+
+        for j in range(linesPerPage):
+            kind = (i + j) % 4
+            if kind == 0:
+                lines.append('verse %i line %i\n' % (i, j))
+            elif kind == 1:
+                lines.append('BGCOLOR:%i chorus %i\n' % (j % 16, j))
+            elif kind == 2:
+                lines.append('FGCOLOR:%i bridge %i\n' % (j % 16, j))
+            else:
+                lines.append('BLINK: count in\n')
+
+        lines.append('CMD:1 only=1,2,3\n')
+        lines.append('CMD:2 wait not=4,5\n')
+        lines.append('CMD:3 next\n')
+        lines.append('---\n')
+
+    return lines
+
+
+RENDER_PAGES = {'PLAIN': ['verse line %i\n' % i for i in range(10)],
+                'BGCOLOR': ['BGCOLOR:%i chorus line %i\n' % (i % 16, i) for i in range(10)],
+                'BLINK': ['BLINK: count in %i\n' % i for i in range(3)] + ['verse\n'] * 5,
+                'MOUSEPOS': [':MOUSEPOS\n', 'verse\n', 'verse\n'],
+                }
+
+
+# -- benchmarks
+
+
+def benchParse(app, results, scale):
+    import pages
+
+    for count in (100 * scale, 1000 * scale):
+        lines = makePages(count)
+
+        results['parse.compile.%i' % count] = summarize(
+            measure(lambda: pages.compilePages(lines, app.COLORS), samples=5))
+
+        directory = tempfile.mkdtemp(prefix='prompter-bench-')
+        try:
+            with open(os.path.join(directory, 'pages.txt'), 'w') as f:
+                f.writelines(lines)
+
+            app.getPath = lambda: directory
+            cachePath = os.path.join(directory, '.pages.cache')
+
+            def cold():
+                if os.path.exists(cachePath):
+                    os.remove(cachePath)
+                app.pageFile = pages.PageFile(app.COLORS)
+                app.loadData()
+
+            def warm():
+                app.pageFile = pages.PageFile(app.COLORS)
+                app.loadData()
+
+            results['parse.loadData.cold.%i' % count] = summarize(measure(cold, samples=5))
+            results['parse.loadData.warm.%i' % count] = summarize(measure(warm, samples=5))
+        finally:
+            shutil.rmtree(directory)
+
+
+def benchRender(app, results, scale):
+    import pages
+
+    lines = []
+    for name, pageLines in RENDER_PAGES.items():
+        lines.append('PAGE: %s\n' % name)
+        lines += pageLines
+
+    app.pages, app.pageCmds, errors = pages.compilePages(lines, app.COLORS)
+    app.pageIndex = pages.PageIndex(app.pages.keys())
+
+    screen = app.mainScreen
+    frames = 200 * scale
+
+    for name in RENDER_PAGES:
+        screen.selectPage(name)
+        app.pageSurfaces.clear()
+
+        def full():
+            screen.invalidate()
+            screen.render()
+            screen.takeDirtyRects()
+
+        def incremental():
+            screen.lastMousePos = (time.perf_counter_ns() % 160, 0)
+            screen.render()
+            screen.takeDirtyRects()
+
+        results['render.%s.full' % name] = summarize(measure(full, samples=frames))
+        results['render.%s.incremental' % name] = summarize(measure(incremental, samples=frames))
+
+
+def benchDispatch(app, results, scale):
+    import pages
+    from midi import MidiThread
+
+    output = FakeOutput()
+    midi = MidiThread(None, devices=(FakeInput(), output))
+    app.midiThread = midi
+
+    screen = app.mainScreen
+
+    for source in ('only=1,2,3', 'not=4,5', 'wait only=1,2,9'):
+        program = pages.compileCommand(source)
+        inverse = pages.compileCommand(source.replace('only=', 'tmp=').replace('not=', 'only=').replace('tmp=', 'not='))
+        program.bind(midi, lambda: None)
+        inverse.bind(midi, lambda: None)
+
+        # alternating with the inverse, so every run changes channel states
+        def dispatch():
+            screen.runCommand(program)
+            screen.sync()
+            screen.runCommand(inverse)
+            screen.sync()
+
+        results['dispatch.%s' % source.replace(' ', '_')] = summarize(measure(dispatch, samples=50, number=100 * scale))
+
+    results['dispatch.messages'] = {'samples': output.sent}
+
+
+def benchMeter(app, results, scale):
+    import meter
+    from capture import RingBuffer, CHANNELS, RATE, SAMPLE_WIDTH
+
+    block = os.urandom(4096)
+    second = RATE * CHANNELS * SAMPLE_WIDTH
+
+    def feed(m):
+        for i in range(second // len(block)):
+            m.process(block)
+
+    results['meter.numpy.second' if meter.numpy is not None else 'meter.array.second'] = summarize(
+        measure(lambda: feed(meter.Meter(CHANNELS, RATE, 20)), samples=10 * scale))
+
+    if meter.numpy is not None:
+        numpy, meter.numpy = meter.numpy, None
+        try:
+            results['meter.array.second'] = summarize(
+                measure(lambda: feed(meter.Meter(CHANNELS, RATE, 20)), samples=3 * scale))
+        finally:
+            meter.numpy = numpy
+
+    ring = RingBuffer(5 * second)
+    results['meter.preroll.write'] = summarize(measure(lambda: ring.write(block), samples=100, number=100 * scale))
+
+
+def benchSysex(app, results, scale):
+    from midi import MidiThread, SysexDecoder
+
+    def sysexPackets(text):
+        data = [0xF0] + list(text.encode('latin-1')) + [0xF7]
+        data += [0] * (-len(data) % 4)
+        return [data[i:i+4] for i in range(0, len(data), 4)]
+
+    packets = sysexPackets('SONG0042 CHORUS')
+    decoder = SysexDecoder()
+
+    def decode():
+        for packet in packets:
+            decoder.feed(packet)
+
+    results['sysex.decode'] = summarize(measure(decode, samples=100, number=100 * scale))
+
+    # whole reads through MidiThread._read, pages mixed with sync notes
+    received = []
+    batch = [[packet, 0] for packet in packets] + [[[0x9F, 60, 100, 0], 0]]
+
+    midi = MidiThread(None, pageCallback=received.append, syncCallback=lambda: None,
+                      coalesce=0, devices=(FakeInput(), FakeOutput()))
+
+    def read():
+        midi.midi_in.batches.append(batch)
+        midi._read()
+
+    results['sysex.read'] = summarize(measure(read, samples=100, number=100 * scale))
+
+
+BENCHMARKS = {'parse': benchParse,
+              'render': benchRender,
+              'dispatch': benchDispatch,
+              'meter': benchMeter,
+              'sysex': benchSysex,
+              }
+
+
+def getVersion():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, old):
+    print('%-36s %12s %12s %8s' % ('benchmark', 'old µs', 'new µs', 'ratio'))
+
+    for name, result in results.items():
+        if not 'median' in result or not name in old or not 'median' in old[name]:
+            continue
+
+        before = old[name]['median']
+        after = result['median']
+        print('%-36s %12.1f %12.1f %7.2fx' % (name, before, after, after / before if before else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run: %s (default all)' % ', '.join(BENCHMARKS))
+    parser.add_argument('-o', '--output', help='write the results to this json file')
+    parser.add_argument('--compare', help='compare with the results in this json file')
+    parser.add_argument('--quick', action='store_true', help='smaller data sets and fewer runs')
+    args = parser.parse_args()
+
+    for name in args.benchmarks:
+        if not name in BENCHMARKS:
+            parser.error('unknown benchmark %s' % name)
+
+    app = loadApp()
+    app.audioThread = FakeAudio()
+    app.initScreens()
+
+    scale = 1 if args.quick else 4
+    results = {}
+
+    for name in args.benchmarks or BENCHMARKS:
+        print('running %s...' % name, file=sys.stderr)
+        BENCHMARKS[name](app, results, scale)
+
+    report = {'version': getVersion(),
+              'python': platform.python_version(),
+              'machine': platform.machine(),
+              'results': results,
+              }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)['results'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""replays a midi capture into the prompter and measures its latencies.
+
+captures are made on the pi with the console command 'midicap FILE'. the
+replay runs headless like tools/bench.py, with the pages of the given
+directory, and reports in ms:
+
+    page.select     arrival of a page name until selectPage has returned
+    page.display    arrival of a page name until the next frame is shown
+    sync.done       arrival of a sync note until sync() has returned
+    sync.display    arrival of a sync note until the next frame is shown
+    out.afterSync   arrival of the last sync note until each midi output
+
+    python3 tools/midireplay.py CAPTURE [--pages DIR] [--speed N] [-o results.json]"""
+
+import statistics
+import threading
+import argparse
+import json
+import time
+import sys
+import os
+
+from bench import loadApp, FakeAudio, ROOT
+
+
+def summarize(latencies):
+    if not latencies:
+        return {'count': 0}
+
+    ordered = sorted(latencies)
+
+    return {'count': len(ordered),
+            'mean': statistics.fmean(ordered) * 1000,
+            'median': statistics.median(ordered) * 1000,
+            'p95': ordered[min(len(ordered) -1, int(len(ordered) * 0.95))] * 1000,
+            'max': ordered[-1] * 1000,
+            }
+
+
+class Probe:
+    """collects the times of the events of interest during the replay"""
+
+    def __init__(self, replay):
+        self.replay = replay
+
+        self.latencies = {'page.select': [],
+                          'page.display': [],
+                          'sync.done': [],
+                          'sync.display': [],
+                          }
+
+        self.waitingFrame = []      # (kind, due) of events not shown yet
+        self.frames = 0
+        self.lock = threading.Lock()    # done() is called from the io loop thread
+
+    def lastDue(self, match):
+        """returns the time the last delivered message matching match became
+        readable"""
+        for i in range(self.replay.next -1, -1, -1):
+            if match(self.replay.messages[i][2]):
+                return self.replay.due[i]
+
+        return None
+
+    def done(self, kind, match):
+        due = self.lastDue(match)
+        if due is None:
+            return
+
+        with self.lock:
+            self.latencies[kind + ('.select' if kind == 'page' else '.done')].append(time.monotonic() - due)
+            self.waitingFrame.append((kind, due))
+
+    def framePresented(self):
+        now = time.monotonic()
+        self.frames += 1
+
+        with self.lock:
+            for kind, due in self.waitingFrame:
+                self.latencies[kind + '.display'].append(now - due)
+
+            self.waitingFrame = []
+
+
+def isSysexEnd(data):
+    return 0xF7 in data
+
+def isSync(data):
+    return data[0] == 0x9F
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('capture', help='capture file written by the midicap console command')
+    parser.add_argument('--pages', default=ROOT, help='directory holding pages.txt or a pages library')
+    parser.add_argument('--speed', type=float, default=1, help='replay speed factor')
+    parser.add_argument('--arrival', action='store_true', help='replay at the arrival times instead of the portmidi timestamps')
+    parser.add_argument('-o', '--output', help='write the results to this json file')
+    args = parser.parse_args()
+
+    app = loadApp()
+
+    from midicapture import loadCapture, ReplayInput, CapturingOutput
+    from midi import MidiThread
+    from ioloop import IOLoop
+    from app import PrompterApp
+
+    replay = ReplayInput(loadCapture(args.capture), speed=args.speed, useArrival=args.arrival)
+    output = CapturingOutput()
+    probe = Probe(replay)
+
+    app.audioThread = FakeAudio()
+    app.initScreens()
+
+    app.getPath = lambda: args.pages
+    app.loadData()
+
+    app.ioLoop = IOLoop()
+    app.ioLoop.start()
+
+    app.mainApp = PrompterApp()
+    app.mainApp.setScreen(app.mainScreen)
+
+    present = app.mainApp.present
+    def presentProbe(screen):
+        present(screen)
+        probe.framePresented()
+    app.mainApp.present = presentProbe
+
+    def pageCallback(pagename):
+        app.pageCallback(pagename)
+        probe.done('page', isSysexEnd)
+
+    def syncCallback():
+        app.syncCallback()
+        probe.done('sync', isSync)
+
+    midi = MidiThread(app.ioLoop, pageCallback=pageCallback, syncCallback=syncCallback,
+                      latency=app.MIDI_LATENCY, coalesce=app.PAGE_COALESCE, devices=(replay, output))
+
+    def finish():
+        if replay.isFinished() and midi.pendingPage is None:
+            app.mainApp.callSoon(app.mainApp.quit)
+        else:
+            app.ioLoop.callLater(0.1, finish)
+
+    print('replaying %i messages, %.1f s' % (len(replay.messages), replay.getDuration()), file=sys.stderr)
+
+    app.startMidi(midi)
+    replay.begin()
+    app.ioLoop.callLater(replay.getDuration() + app.PAGE_COALESCE, finish)
+
+    try:
+        app.mainApp.run()
+    finally:
+        midi.stop()
+        app.ioLoop.stop()
+
+    # the output is related to the sync which triggered it
+    syncs = [due for due, (arrival, timestamp, data) in zip(replay.due, replay.messages) if isSync(data)]
+    afterSync = []
+    sent = []
+
+    for sendTime, status, note, velocity in output.sent:
+        before = [due for due in syncs if due <= sendTime]
+        if before:
+            afterSync.append(sendTime - before[-1])
+
+        sent.append({'time': (sendTime - replay.start) * 1000,
+                     'status': status,
+                     'note': note,
+                     'velocity': velocity,
+                     })
+
+    results = {name: summarize(values) for name, values in probe.latencies.items()}
+    results['out.afterSync'] = summarize(afterSync)
+
+    report = {'capture': os.path.abspath(args.capture),
+              'speed': args.speed,
+              'frames': probe.frames,
+              'results': results,
+              'output': sent,
+              }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()